@@ -1,10 +1,12 @@
 import os
 import time
 import asyncio
+import argparse
 import uvloop
 import aiohttp
+import msgpack
 from urllib.parse import urljoin, quote_plus
-from typing import List
+from typing import List, Dict, Any
 import asyncpg as apg
 from service.config import DB_DSN, DB_USER, DB_PASSWORD
 
@@ -12,14 +14,18 @@ from service.config import DB_DSN, DB_USER, DB_PASSWORD
 api_url = os.getenv('API_URL', 'http://localhost:8080')
 num_requests = 5000
 counter = 0
-parallel_tasks = 100
+parallel_tasks = 100    # Requests in flight, over HTTP and over the WebSocket alike, for a fair comparison.
 actor_names = None
 
 
-async def main():
+async def main(modes: List[str]):
     db_conn = await apg.connect(DB_DSN, user=DB_USER, password=DB_PASSWORD)
-    await bechmark_bn(db_conn)
-    await bechmark_dist(db_conn)
+    if 'http' in modes:
+        await bechmark_bn(db_conn)
+        await bechmark_dist(db_conn)
+    if 'ws' in modes:
+        await benchmark_ws_bn(db_conn)
+        await benchmark_ws_dist(db_conn)
 
 
 async def bechmark_bn(db_conn):
@@ -41,11 +47,30 @@ async def bechmark_dist(db_conn):
     actor_names = await get_some_random_actors(db_conn, num_requests * 2)
 
     start = time.monotonic()
-    await multiply(request_bn, parallel_tasks)
+    await multiply(request_dist, parallel_tasks)
     end = time.monotonic()
     dur = end - start
-    rate = counter / dur
-    print(f'{counter} random pair distances calculated in {round(dur, 1)} ({round(rate)}/s)')
+    rate = counter / 2 / dur
+    print(f'{counter // 2} random pair distances calculated in {round(dur, 1)} ({round(rate)}/s)')
+
+
+async def benchmark_ws_bn(db_conn):
+    names = await get_some_random_actors(db_conn, num_requests)
+    requests = [{'id': i, 'op': 'bn', 'name': name} for i, name in enumerate(names)]
+
+    dur = await request_ws(requests)
+    print(f'{len(requests)} Bacon Numbers calculated over WebSocket in {round(dur, 1)} '
+          f'({round(len(requests) / dur)}/s)')
+
+
+async def benchmark_ws_dist(db_conn):
+    names = await get_some_random_actors(db_conn, num_requests * 2)
+    requests = [{'id': i, 'op': 'dist', 'name1': names[i * 2], 'name2': names[i * 2 + 1]}
+                for i in range(num_requests)]
+
+    dur = await request_ws(requests)
+    print(f'{len(requests)} random pair distances calculated over WebSocket in {round(dur, 1)} '
+          f'({round(len(requests) / dur)}/s)')
 
 
 async def multiply(coroutine, number: int):
@@ -75,9 +100,9 @@ async def request_bn():
 
 async def request_dist():
     global counter
-    url = urljoin(api_url, '/bn')
-    while counter < num_requests:
-        async with aiohttp.ClientSession() as session:
+    url = urljoin(api_url, '/dist')
+    async with aiohttp.ClientSession() as session:
+        while counter < num_requests * 2:
             name1 = actor_names[counter]
             name2 = actor_names[counter + 1]
             counter += 2
@@ -86,6 +111,35 @@ async def request_dist():
                 await response.read()
 
 
+async def request_ws(requests: List[Dict[str, Any]]) -> float:
+    """Pipeline requests over a single connection, keeping `parallel_tasks` of them in flight. Returns duration."""
+    url = urljoin(api_url.replace('http', 'ws', 1), '/ws')
+    window = asyncio.Semaphore(parallel_tasks)
+    pending = {request['id'] for request in requests}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            async def receive():
+                while pending:
+                    response = msgpack.unpackb(await ws.receive_bytes())
+                    assert response['status'] == 200, response
+                    pending.remove(response['id'])   # Responses come in order of completion.
+                    window.release()
+
+            start = time.monotonic()
+            receiver = asyncio.create_task(receive())
+            for request in requests:
+                await window.acquire()
+                await ws.send_bytes(msgpack.packb(request))
+            await receiver
+            return time.monotonic() - start
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the running API')
+    parser.add_argument('--mode', choices=('http', 'ws', 'both'), default='http',
+                        help='query over plain HTTP, the WebSocket channel or both to compare (default: http)')
+    args = parser.parse_args()
+
     uvloop.install()
-    asyncio.run(main())
+    asyncio.run(main(['http', 'ws'] if args.mode == 'both' else [args.mode]))
@@ -0,0 +1,162 @@
+"""
+In-process benchmark of graph searches on the real dataset, bypassing HTTP and DB lookups.
+Builds the graph from the `peers` table with every vertex ordering and storage format
+(or the ones given) and measures the dump size, load time, memory, latency of random
+shortest path queries and throughput of multi-source searches.
+
+Without the database, --synthetic generates random casts of the given number of movies:
+lognormal cast sizes, a few actors playing in many movies, actors numbered in order of
+their first appearance like in the dataset.
+
+Hardware cache misses are not visible from Python; run a single ordering under perf:
+    perf stat -e cache-references,cache-misses python graph_benchmark.py --order bfs --storage plain
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import uvloop
+from itertools import accumulate, combinations
+from typing import List, Optional, Tuple
+from service.config import DB_DSN, DB_USER, DB_PASSWORD
+from service.backend import PostgresDatabase, ActorsGraph
+
+
+num_queries = 5000
+num_batch_sources = 64
+seed = 42
+bacon_name = 'Kevin Bacon'
+
+
+async def main(orders: List[Optional[str]], storages: List[str], synthetic: Optional[int] = None):
+    if synthetic:
+        pairs, bacon_id = generate_pairs(synthetic)
+    else:
+        db = PostgresDatabase(DB_DSN, DB_USER, DB_PASSWORD)
+        await db.init()
+        bacon_id = await db.get_actor_id(bacon_name)
+        pairs = [tuple(row) async for row in db.get_actor_pairs()]
+        await db.close()
+    print(f'Got {len(pairs)} actor pairs')
+
+    for order in orders:
+        for storage in storages:
+            graph = ActorsGraph(reorder=order, storage=storage)
+            start = time.monotonic()
+            await graph.build_from_pairs(iterate(pairs), root=bacon_id)
+            build_time = time.monotonic() - start
+            print(f'order={order or "none"}, storage={storage}: built in {round(build_time, 1)}s')
+            benchmark_dump(graph, len(pairs))
+            benchmark_queries(graph)
+            benchmark_batch(graph)
+
+
+async def iterate(pairs):
+    for pair in pairs:
+        yield pair
+
+
+def generate_pairs(num_movies: int) -> Tuple[List[tuple], int]:
+    """Random peers like get_actor_pairs returns, and the ID of the busiest actor to use instead of Bacon."""
+    rnd = random.Random(seed)
+    # Like in the dataset, an actor plays in 2.7 movies on average, most in one, the busiest in a few dozen.
+    weights = [min(rnd.paretovariate(1.0), 300) for _ in range(num_movies * 15)]
+    cum_weights = list(accumulate(weights))
+    actor_ids = {}
+    peers = {}
+    for movie_id in range(1, num_movies + 1):
+        cast_size = min(60, max(2, int(rnd.lognormvariate(2.5, 0.6))))
+        actors = rnd.choices(range(len(weights)), cum_weights=cum_weights, k=cast_size)
+        cast = sorted({actor_ids.setdefault(actor, len(actor_ids) + 1) for actor in actors})
+        year = rnd.randint(1920, 2017)
+        genres = 1 << rnd.randrange(20) | 1 << rnd.randrange(20)
+        languages = 1 << min(int(rnd.expovariate(0.5)), 62)
+        for id1, id2 in combinations(cast, 2):
+            peer = peers.get((id1, id2))
+            if peer is None:
+                peers[(id1, id2)] = [movie_id, year, year, genres, languages]
+            else:
+                peer[1:] = min(peer[1], year), max(peer[2], year), peer[3] | genres, peer[4] | languages
+
+    busiest = max(actor_ids, key=weights.__getitem__)
+    return [(id1, id2, *peer) for (id1, id2), peer in peers.items()], actor_ids[busiest]
+
+
+def benchmark_dump(graph: ActorsGraph, num_edges: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fpath = os.path.join(tmp_dir, 'graph.dump')
+        graph.save_to_disk(fpath)
+        size = os.path.getsize(fpath)
+
+        start = time.monotonic()
+        ActorsGraph().load_from_disk(fpath)
+        load_time = time.monotonic() - start
+
+        tracemalloc.start()
+        loaded = ActorsGraph()
+        loaded.load_from_disk(fpath)
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+
+    print(f'  dump {size / 2**20:.1f} MB ({size / num_edges:.1f} bytes/edge), loaded in {load_time:.2f}s, '
+          f'heap after load {heap / 2**20:.1f} MB ({heap / num_edges:.1f} bytes/edge)')
+
+
+def benchmark_queries(graph: ActorsGraph):
+    rnd = random.Random(seed)     # Same queries for every configuration.
+    actor_ids = sorted(graph.actor_ids())
+    pairs = [(rnd.choice(actor_ids), rnd.choice(actor_ids)) for _ in range(num_queries)]
+
+    latencies = []
+    for id1, id2 in pairs:
+        start = time.perf_counter()
+        graph.get_path(id1, id2)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    mean = statistics.mean(latencies) * 1000
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f'  {num_queries} queries: mean {mean:.2f} ms, p50 {p50:.2f} ms, p99 {p99:.2f} ms')
+
+
+def benchmark_batch(graph: ActorsGraph):
+    rnd = random.Random(seed)
+    sources = rnd.sample(graph.actor_ids(), num_batch_sources)
+
+    start = time.perf_counter()
+    for source in sources:
+        graph.get_distance_histograms([source])
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    graph.get_distance_histograms(sources)
+    batch = time.perf_counter() - start
+
+    print(f'  {num_batch_sources} full searches: one by one {single:.2f}s, '
+          f'multi-source {batch:.2f}s ({single / batch:.1f}x)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--order', choices=('none',) + ActorsGraph.orderings,
+                        help='benchmark only this ordering (default: all)')
+    parser.add_argument('--storage', choices=ActorsGraph.storages,
+                        help='benchmark only this storage format (default: all)')
+    parser.add_argument('--synthetic', type=int, metavar='MOVIES',
+                        help='benchmark on random casts of this many movies instead of the database')
+    args = parser.parse_args()
+    if args.order is None:
+        orders = [None, *ActorsGraph.orderings]
+    else:
+        orders = [None if args.order == 'none' else args.order]
+    storages = list(ActorsGraph.storages) if args.storage is None else [args.storage]
+
+    uvloop.install()
+    asyncio.run(main(orders, storages, args.synthetic))
@@ -1,22 +1,39 @@
 import logging
 import asyncio
-from typing import Optional
-from fastapi import FastAPI
+import orjson
+import msgpack
+from typing import Optional, List, Dict, Any
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import Response, PlainTextResponse
-from .app import Application, Distance, ActorNotFoundError, NotInitializedError
-from .backend import Database, ActorsGraph
+from .app import Application, Distance, Filters, ActorNotFoundError, NotInitializedError, InvalidFilterError
+from .backend import Database, PostgresDatabase, SqliteDatabase, ActorsGraph
+from .datasets import DatasetRegistry, DatasetNotFoundError, DatasetLoadError
+from .diagnostics import SamplingProfiler, SlowQueryLog, stage
 from .config import *
 
 
 fapi = FastAPI(title='Bacon Number API', version='0.1')
 logger = logging.getLogger(__name__)
 app = None  # type: Optional[Application]
+datasets = None     # type: Optional[DatasetRegistry]
+profiler = SamplingProfiler()
+slow_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE)
+MAX_YEAR = 32767    # Years are smallint in the DB.
+
+
+class FastJSONResponse(Response):
+    """Serializes plain dicts and lists with orjson, skipping jsonable_encoder."""
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
 
 
 @fapi.on_event('startup')
 async def startup():
-    global app
+    global app, datasets
     app = build_application()
+    datasets = build_dataset_registry()
     await app.init()
     logger.info('Service initialized. Ready to accept connections.')
 
@@ -25,41 +42,309 @@ async def startup():
 async def main():
     return PlainTextResponse(
         'GET /bn?name={actor name}&path={true/false} for Bacon number\n'
-        'GET /dist?name1={actor name}&name2={actor name}&path={true/false} for arbitrary actors distance\n')
+        'GET /dist?name1={actor name}&name2={actor name}&path={true/false} for arbitrary actors distance\n'
+        'Both accept one of year_from={year}, year_to={year}, genre={genre name}, language={language code} '
+        'to count only certain movies, and max_dist={number} to stop searching farther\n'
+        'and dataset={name} to query one of GET /datasets instead of the default one\n'
+        '/dist also accepts paths={number} for some alternative shortest paths '
+        'and count=true for the number of them\n')
+
+
+@fapi.get('/healthz')
+async def healthz():
+    """Liveness: the process serves requests, though the graph may still be loading."""
+    return PlainTextResponse('OK')
+
+
+@fapi.get('/readyz')
+async def readyz():
+    """Readiness: the graph is loaded. Reports the progress of loading or why it failed otherwise."""
+    status = app.get_status()
+    if status['ready']:
+        return FastJSONResponse(status)
+    if 'error' in status:
+        return FastJSONResponse(status, status_code=500)
+    return FastJSONResponse(status, status_code=503, headers={'Retry-After': str(status['retry_after'])})
+
+
+@fapi.get('/datasets')
+async def list_datasets():
+    return {'datasets': datasets.names(), 'loaded': list(datasets.loaded)}
 
 
 @fapi.get("/bn")
-async def bacon_distance(name: str, path: bool = False):
+async def bacon_distance(request: Request, name: str, path: bool = False,
+                         year_from: Optional[int] = Query(None, ge=0, le=MAX_YEAR),
+                         year_to: Optional[int] = Query(None, ge=0, le=MAX_YEAR),
+                         genre: Optional[List[str]] = Query(None), language: Optional[List[str]] = Query(None),
+                         max_dist: Optional[int] = Query(None, ge=0), dataset: Optional[str] = None):
+    etag = get_etag(get_generation(dataset))
+    if is_not_modified(request, etag):     # Before loading the dataset, if it is not loaded yet.
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    try:
+        application = await get_application(dataset)
+    except DatasetNotFoundError as e:
+        return Response(status_code=404, content=f'Unknown dataset: {e}')
+    except DatasetLoadError as e:
+        return Response(status_code=500, content=f'Dataset could not be loaded: {e}')
+    etag = etag or get_etag(application.generation)
+
+    with slow_log.trace('/bn'):
+        try:
+            filters = get_filters(year_from, year_to, genre, language)
+            distance = await application.get_bacon_dist(name, path, filters, max_dist)
+            with stage('serialize'):
+                return FastJSONResponse(dist_to_dict(distance), headers=cache_headers(etag))
+        except ActorNotFoundError as e:
+            return Response(status_code=404, content='No actors with name ' + str(e))
+        except InvalidFilterError as e:
+            return Response(status_code=400, content=str(e))
+        except NotInitializedError as e:
+            return Response(status_code=503, content='Service is initializing', headers={'Retry-After': str(e)})
+
+
+@fapi.get("/dist")
+async def actor_distance(request: Request, name1: str, name2: str, path: bool = False,
+                         year_from: Optional[int] = Query(None, ge=0, le=MAX_YEAR),
+                         year_to: Optional[int] = Query(None, ge=0, le=MAX_YEAR),
+                         genre: Optional[List[str]] = Query(None), language: Optional[List[str]] = Query(None),
+                         max_dist: Optional[int] = Query(None, ge=0), dataset: Optional[str] = None,
+                         paths: int = Query(0, ge=0, le=MAX_PATHS), count: bool = False):
+    etag = get_etag(get_generation(dataset))
+    if is_not_modified(request, etag):     # Before loading the dataset, if it is not loaded yet.
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    try:
+        application = await get_application(dataset)
+    except DatasetNotFoundError as e:
+        return Response(status_code=404, content=f'Unknown dataset: {e}')
+    except DatasetLoadError as e:
+        return Response(status_code=500, content=f'Dataset could not be loaded: {e}')
+    etag = etag or get_etag(application.generation)
+
+    with slow_log.trace('/dist'):
+        try:
+            filters = get_filters(year_from, year_to, genre, language)
+            distance = await application.get_actor_dist_by_name(name1, name2, path, filters, max_dist, paths, count)
+            with stage('serialize'):
+                return FastJSONResponse(dist_to_dict(distance), headers=cache_headers(etag))
+        except ActorNotFoundError as e:
+            return Response(status_code=404, content="Some of actors aren't found: " + str(e))
+        except InvalidFilterError as e:
+            return Response(status_code=400, content=str(e))
+        except NotInitializedError as e:
+            return Response(status_code=503, content='Service is initializing', headers={'Retry-After': str(e)})
+
+
+@fapi.websocket("/ws")
+async def query_channel(websocket: WebSocket):
+    """
+    Pipelined queries for high-rate clients. Every binary message is a msgpack-encoded request
+    (or an array of them), a map with `id` (any value, echoed back), `op` ("bn" or "dist") and
+    the query parameters of the HTTP endpoint. Requests run concurrently and every response
+    is sent in its own message as soon as it is ready, so they may come out of order.
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    in_flight = asyncio.Semaphore(WS_MAX_IN_FLIGHT)     # Stop reading new requests while this many run.
+    tasks = set()
+
+    async def send(response: Dict[str, Any]):
+        async with send_lock:
+            await websocket.send_bytes(msgpack.packb(response))
+
+    async def serve(request):
+        try:
+            await send(await run_ws_query(request))
+        finally:
+            in_flight.release()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes') is None:
+                await send(ws_error(None, 400, 'Only binary messages are accepted'))
+                continue
+            try:
+                requests = msgpack.unpackb(message['bytes'])
+            except ValueError:
+                await send(ws_error(None, 400, 'Malformed message'))
+                continue
+
+            for request in requests if isinstance(requests, list) else [requests]:
+                await in_flight.acquire()
+                task = asyncio.create_task(serve(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:    # Nobody to send results to, whatever ended the connection.
+        for task in tasks:
+            task.cancel()
+
+
+async def run_ws_query(request) -> Dict[str, Any]:
+    if not isinstance(request, dict):
+        return ws_error(None, 400, 'Request must be a map')
+    request_id = request.get('id')
+    op = request.get('op')
+    for field in ('name', 'name1', 'name2', 'dataset'):
+        if not isinstance(request.get(field), (str, type(None))):
+            return ws_error(request_id, 400, f'{field} must be a string')
+    max_dist = request.get('max_dist')
+    if max_dist is not None and (not is_int(max_dist) or max_dist < 0):
+        return ws_error(request_id, 400, 'max_dist must be a non-negative integer')
+    paths = request.get('paths', 0)
+    if not is_int(paths) or not 0 <= paths <= MAX_PATHS:
+        return ws_error(request_id, 400, f'paths must be an integer from 0 to {MAX_PATHS}')
+    for field in ('year_from', 'year_to'):
+        if request.get(field) is not None and (not is_int(request[field]) or not 0 <= request[field] <= MAX_YEAR):
+            return ws_error(request_id, 400, f'{field} must be an integer from 0 to {MAX_YEAR}')
+    for field in ('genre', 'language'):
+        values = request.get(field)
+        if values is not None and (not isinstance(values, list) or not all(isinstance(v, str) for v in values)):
+            return ws_error(request_id, 400, f'{field} must be an array of strings')
+
     try:
-        distance = await app.get_bacon_dist(name, path)
-        return dist_to_dict(distance)
+        application = await get_application(request.get('dataset'))
+        filters = get_filters(request.get('year_from'), request.get('year_to'),
+                              request.get('genre'), request.get('language'))
+        with slow_log.trace('ws ' + str(op)):
+            if op == 'bn':
+                distance = await application.get_bacon_dist(request['name'], bool(request.get('path')),
+                                                            filters, max_dist)
+            elif op == 'dist':
+                distance = await application.get_actor_dist_by_name(request['name1'], request['name2'],
+                                                                     bool(request.get('path')), filters, max_dist,
+                                                                     paths, bool(request.get('count')))
+            else:
+                return ws_error(request_id, 400, f'Unknown op: {op}')
+        return {'id': request_id, 'status': 200, 'result': dist_to_dict(distance)}
+    except KeyError as e:
+        return ws_error(request_id, 400, f'Missing field: {e}')
+    except DatasetNotFoundError as e:
+        return ws_error(request_id, 404, f'Unknown dataset: {e}')
+    except DatasetLoadError as e:
+        return ws_error(request_id, 500, f'Dataset could not be loaded: {e}')
     except ActorNotFoundError as e:
-        return Response(status_code=404, content='No actors with name ' + str(e))
+        return ws_error(request_id, 404, "Some of actors aren't found: " + str(e))
+    except InvalidFilterError as e:
+        return ws_error(request_id, 400, str(e))
     except NotInitializedError as e:
-        return Response(status_code=503, content='Service is initializing', headers={'Retry-After': str(e)})
+        response = ws_error(request_id, 503, 'Service is initializing')
+        response['retry_after'] = e.args[0]
+        return response
+    except Exception:   # Keep serving other requests of the connection.
+        logger.exception('Unexpected error in WebSocket query')
+        return ws_error(request_id, 500, 'Internal server error')
 
 
-@fapi.get("/dist")
-async def actor_distance(name1: str, name2: str, path: bool = False):
+def ws_error(request_id, status: int, message: str) -> Dict[str, Any]:
+    return {'id': request_id, 'status': status, 'error': message}
+
+
+def is_int(value) -> bool:
+    """JSON and MessagePack integers, bool is an int subclass in Python but not here."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@fapi.get("/centers")
+async def centers(limit: int = Query(10, ge=1, le=1000)):    # centrality.py ranks 1000 actors by default.
+    return {'centers': await app.get_centers(limit)}
+
+
+@fapi.get("/admin/distances")
+async def distances(names: List[str] = Query(...), targets: Optional[List[str]] = Query(None), histogram: bool = False):
     try:
-        distance = await app.get_actor_dist_by_name(name1, name2, path)
-        return dist_to_dict(distance)
+        if histogram:
+            histograms = await app.get_distance_histograms(names)
+            return {'histograms': dict(zip(names, histograms))}
+        else:
+            matrix = await app.get_distance_matrix(names, targets)
+            return {'sources': names, 'targets': targets or names, 'dist': matrix}
     except ActorNotFoundError as e:
         return Response(status_code=404, content="Some of actors aren't found: " + str(e))
     except NotInitializedError as e:
         return Response(status_code=503, content='Service is initializing', headers={'Retry-After': str(e)})
 
 
+@fapi.get("/admin/profile")
+async def profile(seconds: float = Query(10, gt=0, le=600), interval: float = Query(0.005, gt=0, le=1)):
+    if profiler.running:
+        return Response(status_code=409, content='Profiler is already running')
+    stacks = await profiler.profile(seconds, interval)
+    return PlainTextResponse(stacks, headers={'Content-Disposition': 'attachment; filename="profile.folded"'})
+
+
+@fapi.get("/admin/slow-queries")
+async def slow_queries():
+    return FastJSONResponse({'threshold_ms': slow_log.threshold_ms, 'queries': slow_log.dump()})
+
+
 @fapi.get("/rebuild-graph")
 async def rebuild_graph():
     await asyncio.create_task(app.rebuild_graph())
     return PlainTextResponse('OK')
 
 
+async def get_application(dataset: Optional[str]) -> Application:
+    if dataset is None:
+        return app
+    return await datasets.get(dataset)
+
+
+def get_generation(dataset: Optional[str]) -> Optional[int]:
+    if dataset is None:
+        return app.generation
+    return datasets.generation(dataset)
+
+
+def get_etag(generation: Optional[int]) -> Optional[str]:
+    """Answers only change when the graph is rebuilt (or the API changes)."""
+    if generation is None:
+        return None
+    return f'"{fapi.version}-{generation:x}"'
+
+
+def is_not_modified(request: Request, etag: Optional[str]) -> bool:
+    if etag is None:
+        return False
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def cache_headers(etag: Optional[str]) -> Dict[str, str]:
+    if etag is None:
+        return {}
+    return {'ETag': etag, 'Cache-Control': f'public, max-age={CACHE_MAX_AGE}'}
+
+
+def get_filters(year_from: Optional[int], year_to: Optional[int],
+                genres: Optional[List[str]], languages: Optional[List[str]]) -> Optional[Filters]:
+    filters = Filters(year_from, year_to, genres, languages)
+    return None if filters == Filters() else filters
+
+
 def dist_to_dict(dist: Distance):
     result = {'dist': dist.length}
+    if dist.farther_than is not None:
+        result['farther_than'] = dist.farther_than
+    if dist.budget_exceeded:
+        result['budget_exceeded'] = True
     if dist.path is not None:
         result['path'] = dist.path
+    if dist.movies is not None:
+        result['movies'] = dist.movies
+    if dist.count is not None:  # Can be huge, sent as a string if not exact in double precision.
+        result['count'] = dist.count if dist.count <= 2**53 else str(dist.count)
+    if dist.paths is not None:
+        result['paths'] = dist.paths
     return result
 
 
@@ -67,13 +352,27 @@ def dist_to_dict(dist: Distance):
 async def shutdown():
     logger.info('Shutting down...')
     await app.close()
+    await datasets.close()
 
 
 def build_application():
     # config_logging()
-    db = Database(DB_DSN, DB_USER, DB_PASSWORD)
-    graph = ActorsGraph()
-    return Application(db, graph, GRAPH_CACHE_PATH)
+    db = build_database()
+    graph = ActorsGraph(reorder=GRAPH_REORDER, storage=GRAPH_STORAGE, search_budget=SEARCH_BUDGET)
+    return Application(db, graph, GRAPH_CACHE_PATH, bn_table_fallback=BN_TABLE_FALLBACK)
+
+
+def build_dataset_registry() -> DatasetRegistry:
+    def create_graph():     # Lazily loaded datasets are kept compressed, so that their dumps get memory-mapped.
+        return ActorsGraph(reorder=GRAPH_REORDER, storage='compressed', search_budget=SEARCH_BUDGET)
+
+    return DatasetRegistry(DATASETS_PATH, DATASETS_MEMORY_BUDGET_MB * 2**20, create_graph)
+
+
+def build_database() -> Database:
+    if DB_SNAPSHOT_PATH:
+        return SqliteDatabase(DB_SNAPSHOT_PATH)
+    return PostgresDatabase(DB_DSN, DB_USER, DB_PASSWORD)
 
 
 def config_logging():
@@ -1,57 +1,115 @@
 import os
+import math
 import logging
 import asyncio
-from typing import NamedTuple, List, Optional
+from itertools import islice
+from collections import Counter
+from typing import NamedTuple, List, Optional, Dict, Set, Any
 from .backend.db import Database
-from .backend.graph import ActorsGraph
+from .backend.graph import ActorsGraph, SearchLimitError, BudgetExceededError, SearchStats
+from .backend.filters import EdgeFilter
+from .diagnostics import stage, annotate
 
 
 class Distance(NamedTuple):
-    length: int
+    length: Optional[int]                           # None if the search stopped early, see farther_than.
     path: Optional[List[str]] = None
+    movies: Optional[List[Optional[str]]] = None    # Titles of movies linking consecutive actors of the path.
+    farther_than: Optional[int] = None              # Lower bound of the distance if the search stopped early,
+    budget_exceeded: bool = False                   # because of max_dist or exceeded search budget.
+    count: Optional[int] = None                     # Number of distinct shortest paths.
+    paths: Optional[List[List[str]]] = None         # Some of the shortest paths, path being the first.
+
+
+class Filters(NamedTuple):
+    """Restrictions on movies connecting actors, as requested by clients."""
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    genres: Optional[List[str]] = None      # Genre names.
+    languages: Optional[List[str]] = None   # ISO 639-1 language codes.
 
 
 class ActorNotFoundError(Exception):
     pass
 
 
+class InvalidFilterError(Exception):
+    pass
+
+
 class NotInitializedError(Exception):
     pass
 
 
 class Application:
     bacon_name = 'Kevin Bacon'  # The key actor to serve as the starting point for distance calculations.
-    startup_time = 60           # Typical startup time, to return an estimate if the service is not ready.
+    startup_time = 60           # Typical startup time, to return an estimate if the progress is unknown yet.
+    retry_interval = 5          # Time to come back if the current stage of graph loading has no known size.
 
-    def __init__(self, db: Database, graph: ActorsGraph, graph_cache_path: str):
+    def __init__(self, db: Database, graph: ActorsGraph, graph_cache_path: str, bn_table_fallback: bool = False):
         self.db = db
         self.graph = graph
         self.graph_cache_path = graph_cache_path
+        self.bn_table_fallback = bn_table_fallback  # Serve /bn from bacon_numbers table until the graph is ready.
         self.bacon_id = 0
+        self.movies = {}    # type: Dict[int, str]
+        self.genres = {}    # type: Dict[str, int]
+        self.languages = {}     # type: Dict[str, int]
+        self.graph_task = None  # type: Optional[asyncio.Task]  # Graph building or loading in background.
+        self.graph_error = None     # type: Optional[str]  # Why the graph failed to build or load, if it did.
+        self.shared_genres = set()      # type: Set[str]  # Rare genres sharing a bit of the masks.
+        self.shared_languages = set()   # type: Set[str]  # Rare languages sharing a bit of the masks.
         self.logger = logging.getLogger(type(self).__name__)
 
-    async def init(self):
+    @property
+    def generation(self) -> Optional[int]:
+        """Generation of the graph answers come from, None until it is ready."""
+        return self.graph.generation if self.graph.ready else None
+
+    async def init(self, wait_for_graph: bool = False):
+        """Connect to the DB and load the graph, in background unless `wait_for_graph` and there is a dump."""
         self.logger.info('Initializing...')
         await self.db.init()
         await self.wait_for_db()
         self.bacon_id = await self.db.get_actor_id(self.bacon_name)
+        self.movies = await self.db.get_movie_titles()
+        self.genres = await self.db.get_genres()
+        self.languages = await self.db.get_languages()
+        self.shared_genres = get_shared_bits(self.genres)
+        self.shared_languages = get_shared_bits(self.languages)
+        if self.bn_table_fallback and not await self.db.table_exists('bacon_numbers'):
+            self.bn_table_fallback = False
 
-        # Release control to startup code, to avoid killing the process by Uvicorn after timeout.
-        # It will return 503 meanwhile.
-        asyncio.create_task(self.create_graph())
+        if wait_for_graph and os.path.exists(self.graph_cache_path):
+            await self.create_graph()   # Loading a dump is quick, especially a memory-mapped one.
+        else:
+            # Release control to startup code, to avoid killing the process by Uvicorn after timeout.
+            # It will return 503 meanwhile.
+            self.graph_task = asyncio.create_task(self.create_graph())
+            self.graph_task.add_done_callback(self.on_graph_task_done)
 
     async def create_graph(self):
         if os.path.exists(self.graph_cache_path):
             self.logger.warning(f'Found graph dump {self.graph_cache_path}, loading...')
-            self.graph.load_from_disk(self.graph_cache_path)
+            # Off the event loop, so that readiness checks get answered meanwhile.
+            await asyncio.get_running_loop().run_in_executor(None, self.graph.load_from_disk, self.graph_cache_path)
         else:
             self.logger.warning(f'Graph dump {self.graph_cache_path} was not found, building from DB data...')
             await self.rebuild_graph()
 
+    def on_graph_task_done(self, task: asyncio.Task):
+        """Report a failed build or load right away, the task is never awaited."""
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        self.logger.error('Graph could not be built or loaded', exc_info=error)
+        self.graph_error = str(error) or type(error).__name__
+
     async def rebuild_graph(self):
-        await self.graph.build_from_pairs(self.db.get_actor_pairs())
+        total = await self.db.count_actor_pairs()
+        await self.graph.build_from_pairs(self.db.get_actor_pairs(), root=self.bacon_id, total=total)
         if not os.path.exists(self.graph_cache_path):  # Could be created meanwhile by another process
-            self.graph.save_to_disk(self.graph_cache_path)
+            await asyncio.get_running_loop().run_in_executor(None, self.graph.save_to_disk, self.graph_cache_path)
 
     async def wait_for_db(self):
         while True:
@@ -60,29 +118,97 @@ class Application:
             self.logger.warning('DB is not ready yet, waiting...')
             await asyncio.sleep(5)
 
-    async def get_actor_dist_by_id(self, id1: int, id2: int, with_path: bool) -> Distance:
+    def retry_after(self) -> int:
+        """Seconds until the graph is expected to be ready, for Retry-After headers."""
+        progress = self.graph.progress
+        if progress.stage is None:
+            return self.startup_time
+        remaining = progress.estimate_remaining()
+        if remaining is None:
+            return self.retry_interval
+        return max(1, math.ceil(remaining))
+
+    def get_status(self) -> Dict[str, Any]:
+        progress = self.graph.progress
+        status = {'ready': self.graph.ready, 'stage': progress.stage, 'done': progress.done, 'total': progress.total}
+        if self.graph_error is not None:
+            status['error'] = self.graph_error  # Will not get ready by itself, no point to retry.
+        elif not self.graph.ready:
+            status['retry_after'] = self.retry_after()
+        return status
+
+    async def get_actor_dist_by_id(self, id1: int, id2: int, with_path: bool,
+                                   filters: Optional[Filters] = None, max_dist: Optional[int] = None,
+                                   paths: int = 0, count: bool = False) -> Distance:
+        """Distance between actors, with up to `paths` shortest paths and their total number if `count`."""
+        edge_filter = self.get_edge_filter(filters)
         if not self.graph.ready:
-            raise NotInitializedError(self.startup_time)
+            raise NotInitializedError(self.retry_after())
+
+        stats = SearchStats()
+        annotate(actor_ids=[id1, id2])
+        try:
+            with stage('search'):
+                if paths or count:
+                    shortest = self.graph.get_shortest_paths(id1, id2, edge_filter, max_dist, stats)
+                    alternatives = list(islice(shortest.paths, max(paths, 1)))
+                    path_ids = alternatives[0] if alternatives else []
+                    path_count = shortest.count if count else None
+                else:
+                    path_ids = self.graph.get_path(id1, id2, edge_filter, max_dist, stats)
+                    alternatives = path_count = None
+        except SearchLimitError as e:
+            annotate(expanded=stats.expanded, farther_than=e.farther_than)
+            return Distance(None, farther_than=e.farther_than, budget_exceeded=isinstance(e, BudgetExceededError))
 
-        path_ids = self.graph.get_path(id1, id2)
         length = len(path_ids) - 1  # Node <--> Node: 2 nodes, 1 step.
+        annotate(expanded=stats.expanded, distance=length)
+        if not with_path and not paths:
+            return Distance(length, count=path_count)
 
-        if with_path:
-            path_names = await self.db.get_actor_names(path_ids)
-            path = [path_names[id_] for id_ in path_ids]
-            return Distance(length, path)
-        else:
-            return Distance(length)
+        with stage('names'):
+            if paths:   # The first of them is the path.
+                actor_names = await self.db.get_actor_names(list({id_ for ids in alternatives for id_ in ids}))
+            else:
+                actor_names = await self.db.get_actor_names(path_ids)
+        path_names = [[actor_names[id_] for id_ in ids] for ids in alternatives] if paths else None
+        if not with_path:
+            return Distance(length, count=path_count, paths=path_names)
+
+        path = [actor_names[id_] for id_ in path_ids]
+        with stage('movies'):
+            if edge_filter is None or len(path_ids) < 2:
+                movie_ids = self.graph.get_path_movies(path_ids)
+            else:   # The representative movie of an edge may not match the filter, look for one that does.
+                movie_ids = await self.db.get_linking_movies(path_ids, edge_filter)
+        movies = [self.movies.get(movie_id) for movie_id in movie_ids]
+        return Distance(length, path, movies, count=path_count, paths=path_names)
 
-    async def get_bacon_dist(self, actor_name: str, with_path: bool) -> Distance:
-        actor_id = await self.db.get_actor_id(actor_name)
+    async def get_bacon_dist(self, actor_name: str, with_path: bool, filters: Optional[Filters] = None,
+                             max_dist: Optional[int] = None) -> Distance:
+        with stage('lookup'):
+            actor_id = await self.db.get_actor_id(actor_name)
         if actor_id is None:
             raise ActorNotFoundError(actor_name)
 
-        return await self.get_actor_dist_by_id(self.bacon_id, actor_id, with_path)
+        if not self.graph.ready and self.bn_table_fallback and not with_path and self.get_edge_filter(filters) is None:
+            return await self.get_precomputed_bacon_dist(actor_id, max_dist)
+
+        return await self.get_actor_dist_by_id(self.bacon_id, actor_id, with_path, filters, max_dist)
+
+    async def get_precomputed_bacon_dist(self, actor_id: int, max_dist: Optional[int] = None) -> Distance:
+        length = await self.db.get_bacon_number(actor_id)
+        if length is None:  # Actor added after the table was computed.
+            raise NotInitializedError(self.retry_after())
+        if max_dist is not None and length > max_dist:
+            return Distance(None, farther_than=max_dist)
+        return Distance(length)
 
-    async def get_actor_dist_by_name(self, name1: str, name2: str, with_path: bool) -> Distance:
-        actor_ids = await self.db.get_actor_ids([name1, name2])
+    async def get_actor_dist_by_name(self, name1: str, name2: str, with_path: bool,
+                                     filters: Optional[Filters] = None, max_dist: Optional[int] = None,
+                                     paths: int = 0, count: bool = False) -> Distance:
+        with stage('lookup'):
+            actor_ids = await self.db.get_actor_ids([name1, name2])
 
         try:
             id1 = actor_ids[name1]
@@ -90,8 +216,80 @@ class Application:
         except KeyError:
             raise ActorNotFoundError([name1, name2])
 
-        return await self.get_actor_dist_by_id(id1, id2, with_path)
+        return await self.get_actor_dist_by_id(id1, id2, with_path, filters, max_dist, paths, count)
+
+    def get_edge_filter(self, filters: Optional[Filters]) -> Optional[EdgeFilter]:
+        if filters is None or filters == Filters():
+            return None
+
+        # Connections keep the years, genres and languages of all shared movies together, not which movie
+        # has which, so only a single criterion is answered exactly.
+        criteria = [filters.year_from is not None, filters.year_to is not None, bool(filters.genres),
+                    bool(filters.languages)]
+        if sum(criteria) > 1:
+            raise InvalidFilterError('Only one of year_from, year_to, genre and language can be used at a time')
+
+        genres = 0
+        for genre in filters.genres or []:
+            if genre not in self.genres:
+                raise InvalidFilterError(f'Unknown genre: {genre}')
+            if genre in self.shared_genres:
+                raise InvalidFilterError(f'Genre is too rare to filter by: {genre}')
+            genres |= 1 << self.genres[genre]
+
+        languages = 0
+        for language in filters.languages or []:
+            if language not in self.languages:
+                raise InvalidFilterError(f'Unknown language: {language}')
+            if language in self.shared_languages:
+                raise InvalidFilterError(f'Language is too rare to filter by: {language}')
+            languages |= 1 << self.languages[language]
+
+        return EdgeFilter(filters.year_from, filters.year_to, genres, languages)
+
+    async def get_distance_matrix(self, names: List[str], targets: Optional[List[str]] = None) -> List[List[int]]:
+        targets = targets or names
+        actor_ids = await self.get_existing_actor_ids(names + targets)
+        if not self.graph.ready:
+            raise NotInitializedError(self.retry_after())
+
+        # Batch searches take a while, run them off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.graph.get_distance_matrix, [actor_ids[n] for n in names], [actor_ids[n] for n in targets])
+
+    async def get_distance_histograms(self, names: List[str]) -> List[List[int]]:
+        actor_ids = await self.get_existing_actor_ids(names)
+        if not self.graph.ready:
+            raise NotInitializedError(self.retry_after())
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.graph.get_distance_histograms, [actor_ids[n] for n in names])
+
+    async def get_centers(self, limit: int) -> List[Dict[str, Any]]:
+        """Actors ranked as graph centers by init/centrality.py, empty if it was not run."""
+        if not await self.db.table_exists('centrality'):
+            return []
+        return await self.db.get_centers(limit)
+
+    async def get_existing_actor_ids(self, names: List[str]) -> Dict[str, int]:
+        actor_ids = await self.db.get_actor_ids(list(set(names)))
+        missing = [name for name in names if name not in actor_ids]
+        if missing:
+            raise ActorNotFoundError(missing)
+        return actor_ids
+
+    def cancel_graph_task(self):
+        """Stop building or loading the graph in background, if it is in progress."""
+        if self.graph_task is not None:
+            self.graph_task.cancel()
 
     async def close(self):
         # self.graph.save_to_disk(self.graph_cache_path)
+        self.cancel_graph_task()
         await self.db.close()
+
+
+def get_shared_bits(bits: Dict[str, int]) -> Set[str]:
+    """Names sharing a bit of the masks with others, see init/dataset_to_db.py."""
+    bit_counts = Counter(bits.values())
+    return {name for name, bit in bits.items() if bit_counts[bit] > 1}
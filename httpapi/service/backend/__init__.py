@@ -1,2 +1,3 @@
 from .graph import ActorsGraph
-from .db import Database
+from .db import Database, PostgresDatabase
+from .sqlite import SqliteDatabase
@@ -0,0 +1,266 @@
+import mmap
+import struct
+import networkx as nx
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Sequence, Dict
+from .filters import EdgeFilter
+
+
+class CompressedAdjacency:
+    """
+    Read-only adjacency in CSR layout with compressed neighbor lists.
+
+    Vertices are numbered 0..N-1, `external_ids` maps them to actor IDs. Neighbor lists are
+    sorted and stored as gaps between consecutive neighbors encoded as varints (7 bits per byte,
+    high bit set on all bytes but the last), `offsets[v]:offsets[v + 1]` is the byte range of
+    vertex v in `data`. Lists are decoded on the fly when a vertex is expanded.
+
+    Edge labels are interned as in plain graphs: distinct label tuples are stored once in
+    arrays of `label_data` (see `label_fields`), and `edge_labels`, parallel to the decoded
+    neighbor lists, has an index into them per edge: the k-th neighbor of v has its movie at
+    `label_data['movies'][edge_labels[edge_offsets[v] + k]]`.
+
+    Actor IDs are looked up by binary search: in `external_ids` itself if it is sorted,
+    otherwise in the order of `actor_order`, the vertices sorted by actor ID (the inverse
+    of the permutation of reordered graphs), so no map of IDs has to be built on load.
+
+    File layout (little endian): magic, header (num_nodes, num_edges, num_labels, actor_order
+    length, data length, generation), offsets (uint64 x num_nodes + 1),
+    edge_offsets (uint64 x num_nodes + 1), external_ids (uint32 x num_nodes),
+    actor_order (uint32 x num_nodes, or none if external_ids is sorted),
+    label arrays (x num_labels each), edge_labels (uint32 x 2 num_edges), data.
+    Files are memory-mapped on load, so only the pages touched by searches are read.
+    """
+    magic_prefix = b'BNCSR'
+    magic = b'BNCSR006'
+    header = struct.Struct('<QQQQQQ')
+    # Label arrays: name, array type, edge attribute in NetworkX graph. Widest types first.
+    label_fields = (
+        ('language_masks', 'Q', 'languages'),
+        ('movies', 'I', 'movie'),
+        ('genre_masks', 'I', 'genres'),
+        ('min_years', 'H', 'min_year'),
+        ('max_years', 'H', 'max_year'),
+    )
+
+    def __init__(self, offsets: Sequence[int], edge_offsets: Sequence[int], external_ids: Sequence[int],
+                 actor_order: Sequence[int], label_data: Dict[str, Sequence[int]], edge_labels: Sequence[int],
+                 data: Sequence[int], num_edges: int, generation: int = 0):
+        self.offsets = offsets
+        self.edge_offsets = edge_offsets
+        self.external_ids = external_ids
+        self.actor_order = actor_order  # Empty if external_ids is sorted.
+        self.label_data = label_data
+        self.edge_labels = edge_labels
+        self.data = data
+        self.num_edges = num_edges
+        self.generation = generation    # See ActorsGraph.generation.
+        self.mmap = None    # type: Optional[mmap.mmap]
+
+    @classmethod
+    def from_graph(cls, graph: nx.Graph) -> 'CompressedAdjacency':
+        """
+        Compress a graph. Reordered graphs (see ActorsGraph) keep their vertex numbering,
+        other graphs are numbered in ascending actor ID order.
+        """
+        external_ids = graph.graph.get('external_ids')
+        if external_ids is None:
+            external_ids = sorted(graph)
+            mapping = {actor_id: i for i, actor_id in enumerate(external_ids)}
+            nodes = external_ids
+            actor_order = array('I')
+        else:
+            mapping = None
+            nodes = range(len(external_ids))
+            actor_order = array('I', sorted(nodes, key=external_ids.__getitem__))
+
+        offsets = array('Q', [0])
+        edge_offsets = array('Q', [0])
+        label_data = {name: array(typecode) for name, typecode, _ in cls.label_fields}
+        labels = {}     # type: Dict[tuple, int]
+        edge_labels = array('I')
+        data = bytearray()
+        for node in nodes:
+            edges = sorted((peer if mapping is None else mapping[peer], attrs)
+                           for peer, attrs in graph._adj[node].items())
+            encode_gaps([peer for peer, _ in edges], data)
+            for _, attrs in edges:
+                key = tuple(attrs.get(attr, 0) for _, _, attr in cls.label_fields)
+                label = labels.get(key)
+                if label is None:
+                    label = labels[key] = len(labels)
+                    for (name, _, _), value in zip(cls.label_fields, key):
+                        label_data[name].append(value)
+                edge_labels.append(label)
+            offsets.append(len(data))
+            edge_offsets.append(edge_offsets[-1] + len(edges))
+
+        return cls(offsets, edge_offsets, array('I', external_ids), actor_order, label_data, edge_labels,
+                   bytes(data), graph.number_of_edges(), graph.graph.get('generation', 0))
+
+    @classmethod
+    def is_compressed_file(cls, fpath: str) -> bool:
+        with open(fpath, 'rb') as f:
+            return f.read(len(cls.magic_prefix)) == cls.magic_prefix
+
+    @classmethod
+    def read_generation(cls, fpath: str) -> Optional[int]:
+        """Generation of a dump from its header, None if there is no dump in the current format."""
+        try:
+            with open(fpath, 'rb') as f:
+                head = f.read(len(cls.magic) + cls.header.size)
+        except FileNotFoundError:
+            return None
+        if len(head) < len(cls.magic) + cls.header.size or head[:len(cls.magic)] != cls.magic:
+            return None
+        return cls.header.unpack_from(head, len(cls.magic))[-1] or None
+
+    @classmethod
+    def load(cls, fpath: str) -> 'CompressedAdjacency':
+        with open(fpath, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(mm)
+        if buffer[:len(cls.magic)] != cls.magic:
+            raise ValueError(f'Unsupported graph dump format {bytes(buffer[:len(cls.magic)])} in {fpath}, '
+                             f'remove it to rebuild the graph')
+
+        pos = len(cls.magic)
+        num_nodes, num_edges, num_labels, order_len, data_len, generation = cls.header.unpack_from(buffer, pos)
+        pos += cls.header.size
+        offsets = buffer[pos:pos + (num_nodes + 1) * 8].cast('Q')
+        pos += (num_nodes + 1) * 8
+        edge_offsets = buffer[pos:pos + (num_nodes + 1) * 8].cast('Q')
+        pos += (num_nodes + 1) * 8
+        external_ids = buffer[pos:pos + num_nodes * 4].cast('I')
+        pos += num_nodes * 4
+        actor_order = buffer[pos:pos + order_len * 4].cast('I')
+        pos += order_len * 4
+        label_data = {}
+        for name, typecode, _ in cls.label_fields:
+            size = num_labels * array(typecode).itemsize
+            label_data[name] = buffer[pos:pos + size].cast(typecode)
+            pos += size
+        edge_labels = buffer[pos:pos + num_edges * 2 * 4].cast('I')
+        pos += num_edges * 2 * 4
+        data = buffer[pos:pos + data_len]
+
+        result = cls(offsets, edge_offsets, external_ids, actor_order, label_data, edge_labels, data, num_edges,
+                     generation)
+        result.mmap = mm
+        return result
+
+    def save(self, fpath: str):
+        with open(fpath, 'wb') as f:
+            f.write(self.magic)
+            f.write(self.header.pack(len(self), self.num_edges, self.num_labels(), len(self.actor_order),
+                                     len(self.data), self.generation))
+            f.write(bytes(self.offsets))
+            f.write(bytes(self.edge_offsets))
+            f.write(bytes(self.external_ids))
+            f.write(bytes(self.actor_order))
+            for name, _, _ in self.label_fields:
+                f.write(bytes(self.label_data[name]))
+            f.write(bytes(self.edge_labels))
+            f.write(self.data)
+
+    def vertex(self, actor_id: int) -> Optional[int]:
+        """Vertex of an actor, None if the actor is not in the graph."""
+        external_ids = self.external_ids
+        if not self.actor_order:
+            k = bisect_left(external_ids, actor_id)
+            return k if k < len(external_ids) and external_ids[k] == actor_id else None
+
+        order = self.actor_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if external_ids[order[mid]] < actor_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return order[lo] if lo < len(order) and external_ids[order[lo]] == actor_id else None
+
+    def neighbors(self, v: int) -> List[int]:
+        data = self.data
+        pos = self.offsets[v]
+        end = self.offsets[v + 1]
+        result = []
+        value = 0
+        while pos < end:
+            gap = 0
+            shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                gap |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            value += gap
+            result.append(value)
+
+        return result
+
+    def filtered_neighbors(self, v: int, edge_filter: EdgeFilter) -> List[int]:
+        """Neighbors of v connected by edges the filter allows."""
+        peers = self.neighbors(v)
+        base = self.edge_offsets[v]
+        allows = edge_filter.allows
+        min_years = self.label_data['min_years']
+        max_years = self.label_data['max_years']
+        genre_masks = self.label_data['genre_masks']
+        language_masks = self.label_data['language_masks']
+        return [u for u, k in zip(peers, self.edge_labels[base:base + len(peers)])
+                if allows(min_years[k], max_years[k], genre_masks[k], language_masks[k])]
+
+    def edge_index(self, v: int, u: int) -> Optional[int]:
+        """Position of edge v - u in edge_labels, None if there is no such edge."""
+        peers = self.neighbors(v)
+        k = bisect_left(peers, u)
+        if k == len(peers) or peers[k] != u:
+            return None
+        return self.edge_offsets[v] + k
+
+    def edge_movie(self, v: int, u: int) -> Optional[int]:
+        i = self.edge_index(v, u)
+        if i is None:
+            return None
+        return self.label_data['movies'][self.edge_labels[i]] or None
+
+    def __getitem__(self, v: int) -> List[int]:
+        return self.neighbors(v)
+
+    def __contains__(self, v: int) -> bool:
+        return 0 <= v < len(self)
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def number_of_edges(self) -> int:
+        return self.num_edges
+
+    def num_labels(self) -> int:
+        return len(self.label_data['movies'])
+
+    def size_in_bytes(self) -> int:
+        labels_size = sum(len(self.label_data[name]) * array(typecode).itemsize
+                          for name, typecode, _ in self.label_fields)
+        return (len(self.offsets) + len(self.edge_offsets)) * 8 + (len(self.external_ids) + len(self.actor_order)) * 4 \
+            + labels_size + len(self.edge_labels) * 4 + len(self.data)
+
+
+def encode_gaps(values: List[int], out: bytearray):
+    """Append sorted values to `out` as varint-encoded gaps, the first gap is from zero."""
+    prev = 0
+    for value in values:
+        gap = value - prev
+        prev = value
+        while gap >= 0x80:
+            out.append(gap & 0x7f | 0x80)
+            gap >>= 7
+        out.append(gap)
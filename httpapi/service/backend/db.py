@@ -1,10 +1,72 @@
 import asyncpg
+from abc import ABC, abstractmethod
 from asyncpg import Connection
 from asyncpg.pool import Pool
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from .filters import EdgeFilter
 
 
-class Database:
+class Database(ABC):
+    """Lookups the service needs besides the graph. See PostgresDatabase and SqliteDatabase."""
+
+    @abstractmethod
+    async def init(self):
+        pass
+
+    @abstractmethod
+    async def get_actor_id(self, actor_name: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def get_actor_ids(self, actor_names: List[str]) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def get_actor_names(self, actor_ids: List[int]) -> Dict[int, str]:
+        pass
+
+    @abstractmethod
+    async def get_movie_titles(self) -> Dict[int, str]:
+        pass
+
+    @abstractmethod
+    async def get_genres(self) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def get_languages(self) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def get_linking_movies(self, path: List[int], edge_filter: EdgeFilter) -> List[Optional[int]]:
+        """For every two consecutive actors of the path, a shared movie matching the filter."""
+
+    @abstractmethod
+    def get_actor_pairs(self) -> AsyncIterator[Tuple[int, int, int, int, int, int, int]]:
+        """(id1, id2, movie_id, min_year, max_year, genre_mask, language_mask) for every pair of peers."""
+
+    @abstractmethod
+    async def count_actor_pairs(self) -> int:
+        pass
+
+    @abstractmethod
+    async def get_bacon_number(self, actor_id: int) -> Optional[int]:
+        """Precomputed Bacon number (-1 if not connected) from `bacon_numbers` table, None if the actor is not there."""
+
+    @abstractmethod
+    async def get_centers(self, limit: int) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def table_exists(self, table_name: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class PostgresDatabase(Database):
     def __init__(self, dsn: str, username: str, password: str):
         self.dsn = dsn
         self.user = username
@@ -14,7 +76,7 @@ class Database:
     async def init(self):
         self.pool = await asyncpg.create_pool(self.dsn, user=self.user, password=self.pasword)
 
-    async def get_actor_id(self, actor_name: str) -> int:
+    async def get_actor_id(self, actor_name: str) -> Optional[int]:
         async with self.pool.acquire() as conn:     # type: Connection
             return await conn.fetchval('select id from actors where name = $1', actor_name)
 
@@ -30,12 +92,70 @@ class Database:
 
         return {row[0]: row[1] for row in result}
 
+    async def get_movie_titles(self) -> Dict[int, str]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            result = await conn.fetch('select id, name from movies')
+
+        return {row[0]: row[1] for row in result}
+
+    async def get_genres(self) -> Dict[str, int]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            result = await conn.fetch('select name, bit from genres')
+
+        return {row[0]: row[1] for row in result}
+
+    async def get_languages(self) -> Dict[str, int]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            result = await conn.fetch('select code, bit from languages')
+
+        return {row[0]: row[1] for row in result}
+
+    async def get_linking_movies(self, path: List[int], edge_filter: EdgeFilter) -> List[Optional[int]]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            result = await conn.fetch('''
+                select p.id1, p.id2, min(c1.movie_id)
+                from unnest($1::integer[], $2::integer[]) p(id1, id2)
+                join cast_data c1 on c1.actor_id = p.id1
+                join cast_data c2 on c2.actor_id = p.id2 and c2.movie_id = c1.movie_id
+                join movies m on m.id = c1.movie_id
+                where ($3::smallint is null or m.release_year >= $3)
+                    and ($4::smallint is null or m.release_year <= $4)
+                    and ($5::integer = 0 or m.genre_mask & $5 != 0)
+                    and ($6::bigint = 0 or m.language_mask & $6 != 0)
+                group by p.id1, p.id2
+            ''', path[:-1], path[1:], edge_filter.year_from, edge_filter.year_to,
+                edge_filter.genres, edge_filter.languages)
+
+        movies = {(row[0], row[1]): row[2] for row in result}
+        return [movies.get(pair) for pair in zip(path, path[1:])]
+
     async def get_actor_pairs(self):
         async with self.pool.acquire() as conn:     # type: Connection
             async with conn.transaction():
-                async for row in conn.cursor('select id1, id2 from peers where id1 < id2'):
+                async for row in conn.cursor('select id1, id2, movie_id, min_year, max_year, genre_mask, language_mask '
+                                             'from peers where id1 < id2'):
                     yield row
 
+    async def count_actor_pairs(self) -> int:
+        async with self.pool.acquire() as conn:     # type: Connection
+            return await conn.fetchval('select count(*) from peers where id1 < id2')
+
+    async def get_bacon_number(self, actor_id: int) -> Optional[int]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            return await conn.fetchval('select bn from bacon_numbers where actor_id = $1', actor_id)
+
+    async def get_centers(self, limit: int) -> List[Dict[str, Any]]:
+        async with self.pool.acquire() as conn:     # type: Connection
+            result = await conn.fetch('''
+                select c.rank, a.name, c.closeness, c.avg_distance, c.eccentricity, c.harmonic, c.reached
+                from centrality c
+                join actors a on c.actor_id = a.id
+                order by c.rank
+                limit $1
+            ''', limit)
+
+        return [dict(row) for row in result]
+
     async def table_exists(self, table_name: str) -> bool:
         async with self.pool.acquire() as conn:     # type: Connection
             result = await conn.fetch('select 1 from information_schema.tables where table_name = $1', table_name)
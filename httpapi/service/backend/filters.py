@@ -0,0 +1,23 @@
+from typing import NamedTuple, Optional
+
+
+class EdgeFilter(NamedTuple):
+    """
+    Restricts searches to connections made in certain movies.
+
+    Every edge carries the range of release years and the union of genre and language masks
+    of all movies shared by the two actors, so the criteria are checked independently: an edge
+    passes if some shared movie matches each criterion, not necessarily the same movie.
+    Thus only filters with a single criterion are exact, the API accepts no others.
+    Edges with unknown release years (0) never pass year criteria.
+    """
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    genres: int = 0         # Bitmask of allowed genres, 0 for any.
+    languages: int = 0      # Bitmask of allowed languages, 0 for any.
+
+    def allows(self, min_year: int, max_year: int, genres: int, languages: int) -> bool:
+        return (self.year_from is None or max_year >= self.year_from) \
+            and (self.year_to is None or 0 < min_year <= self.year_to) \
+            and (not self.genres or genres & self.genres != 0) \
+            and (not self.languages or languages & self.languages != 0)
@@ -1,34 +1,158 @@
+import os
+import time
+import pickle
+import asyncio
 import logging
 import networkx as nx
-from networkx.algorithms.shortest_paths.generic import shortest_path
-from networkx.readwrite.gpickle import read_gpickle, write_gpickle
-from typing import Optional
+from collections import deque
+from networkx.readwrite.gpickle import write_gpickle
+from networkx.utils import reverse_cuthill_mckee_ordering
+from typing import Optional, List, Dict, Iterable, Iterator, Callable, Union, NamedTuple
+from .compressed import CompressedAdjacency
+from .filters import EdgeFilter
+from .msbfs import distance_matrix, distance_histograms
 
 
-class ActorsGraph:
+class SearchLimitError(Exception):
+    """The search stopped before reaching the target, which is known to be farther than `farther_than`."""
+    def __init__(self, farther_than: int):
+        super().__init__(farther_than)
+        self.farther_than = farther_than
+
+
+class DistanceLimitError(SearchLimitError):
+    pass
+
+
+class BudgetExceededError(SearchLimitError):
+    pass
+
+
+class SearchStats:
+    """Work done by a search, for diagnostics."""
+
     def __init__(self):
-        self.graph = None   # type: Optional[nx.Graph]
+        self.expanded = 0   # Vertices whose neighbors were scanned.
+
+
+class ShortestPaths(NamedTuple):
+    length: int                     # -1 if there is no path.
+    count: int                      # Number of distinct shortest paths.
+    paths: Iterator[List[int]]      # Enumerated lazily.
+
+
+class LoadProgress:
+    """Progress of building or loading the graph, to tell clients when to come back."""
+
+    def __init__(self):
+        # Units (edges or bytes) processed at the current stage out of total, None if the size is unknown.
+        self.stage = None   # type: Optional[str]
+        self.done = 0
+        self.total = None   # type: Optional[int]
+        self.started = None     # type: Optional[float]
+
+    def start(self, stage: str, total: Optional[int] = None):
+        self.stage = stage
+        self.done = 0
+        self.total = total
+        self.started = time.monotonic()
+
+    def estimate_remaining(self) -> Optional[float]:
+        """Seconds left at the current stage by its rate so far, None if the stage has no known size."""
+        if self.started is None or not self.total or not self.done:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed * max(self.total - self.done, 0) / self.done
+
+
+class ProgressReader:
+    """File wrapper counting bytes read, to track progress of unpickling."""
+
+    def __init__(self, f, progress: LoadProgress):
+        self.f = f
+        self.progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.progress.done += len(data)
+        return data
+
+    def readline(self) -> bytes:
+        data = self.f.readline()
+        self.progress.done += len(data)
+        return data
+
+
+class ActorsGraph:
+    orderings = ('bfs', 'rcm', 'degree')    # Supported vertex reordering strategies.
+    storages = ('plain', 'compressed')      # Supported in-memory (and disk cache) formats.
+    plain_bytes_per_edge = 150      # Heap taken by NetworkX per edge, with attributes interned by build_from_pairs.
+    plain_format = 2    # Version of plain dumps, kept in graph.graph['format']. Version 1 had no edge labels.
+
+    def __init__(self, reorder: Optional[str] = None, storage: Optional[str] = None,
+                 search_budget: Optional[int] = None):
+        if reorder and reorder not in self.orderings:
+            raise ValueError(f'Unknown graph ordering: {reorder}')
+        if storage and storage not in self.storages:
+            raise ValueError(f'Unknown graph storage: {storage}')
+
+        self.graph = None   # type: Optional[Union[nx.Graph, CompressedAdjacency]]
+        self.neighbors = None   # type: Optional[Callable[[int], Iterable[int]]]
+        self.reorder = reorder or None
+        self.storage = storage or 'plain'
+        self.search_budget = search_budget or None  # Max vertices to expand in a single search.
+        # Identifies graph contents: set when the graph is built and kept in the dump.
+        self.generation = None      # type: Optional[int]
+        self.external_ids = None    # type: Optional[List[int]]
+        self.internal_ids = None    # type: Optional[Dict[int, int]]
+        self.progress = LoadProgress()
         self.logger = logging.getLogger(type(self).__name__)
         self.ready = False
 
     def load_from_disk(self, fpath: str):
+        """Load a dump. Blocks for a while with plain storage, run it off the event loop to report progress."""
         self.logger.warning(f'Loading graph data from {fpath}...')
-        self.graph = read_gpickle(fpath)
+        self.progress.start('loading', os.path.getsize(fpath))
+        if CompressedAdjacency.is_compressed_file(fpath):
+            self.set_graph(CompressedAdjacency.load(fpath))   # Memory-mapped, nothing to wait for.
+        else:
+            with open(fpath, 'rb') as f:
+                graph = pickle.load(ProgressReader(f, self.progress))
+            if graph.graph.get('format') != self.plain_format:
+                raise ValueError(f'Unsupported graph dump format {graph.graph.get("format", 1)} in {fpath}, '
+                                 f'remove it to rebuild the graph')
+            self.set_graph(graph)
+        self.progress.done = self.progress.total
+        if not self.generation:     # Dumps made before generations were introduced.
+            self.generation = os.stat(fpath).st_mtime_ns
         self.ready = True
         self.logger.warning('Graph was loaded from disk')
 
     def save_to_disk(self, fpath: str):
         self.logger.warning(f'Saving graph data to {fpath}...')
-        write_gpickle(self.graph, fpath)
+        if isinstance(self.graph, CompressedAdjacency):
+            self.graph.save(fpath)
+        else:
+            write_gpickle(self.graph, fpath)
         self.logger.warning('Graph was saved to disk')
 
-    async def build_from_pairs(self, pairs):
+    async def build_from_pairs(self, pairs, root: Optional[int] = None, total: Optional[int] = None):
+        """
+        Build the graph from (id1, id2, movie, years, genres, languages) tuples, `total` of them if known.
+
+        Edge attributes are interned: actors sharing a single movie get the same labels, so all edges of
+        a movie cast point to one attribute dict instead of a dict per edge, which would take
+        more memory than the adjacency itself. The dicts must never be modified.
+        """
         added = set()
         counter = 0
         graph = nx.Graph()
+        adj = graph._adj
+        labels = {}     # type: Dict[tuple, Dict[str, int]]
         self.logger.warning('Building graph from DB data...')
+        self.progress.start('building', total)
 
-        async for id1, id2 in pairs:
+        async for id1, id2, movie_id, min_year, max_year, genres, languages in pairs:
             if id1 not in added:
                 graph.add_node(id1)
                 added.add(id1)
@@ -37,20 +161,395 @@ class ActorsGraph:
                 graph.add_node(id2)
                 added.add(id2)
 
-            graph.add_edge(id1, id2)
+            key = (movie_id, min_year, max_year, genres, languages)
+            attrs = labels.get(key)
+            if attrs is None:
+                attrs = labels[key] = dict(movie=movie_id, min_year=min_year, max_year=max_year,
+                                           genres=genres, languages=languages)
+            adj[id1][id2] = adj[id2][id1] = attrs
 
             counter += 1
+            self.progress.done = counter
             if counter % 100000 == 0:
                 self.logger.warning(f'{counter} edges processed')
 
-        self.logger.warning(f'{counter} edges processed')
-        self.graph = graph
+        self.logger.warning(f'{counter} edges processed, {len(labels)} distinct labels')
+        del labels
+
+        # Reordering and compression take a while, run them off the event loop to answer health checks.
+        graph = await asyncio.get_running_loop().run_in_executor(None, self.finish_graph, graph, root)
+        self.set_graph(graph)
         self.ready = True
 
-    def get_path(self, src: int, dst: int):
-        try:
-            result = shortest_path(self.graph, src, dst)
-        except (nx.NetworkXNoPath, nx.NodeNotFound):    # Isolated single nodes are not added.
-            result = []
+    def finish_graph(self, graph: nx.Graph, root: Optional[int] = None) -> Union[nx.Graph, CompressedAdjacency]:
+        """Reorder and compress a built graph as configured."""
+        if self.reorder:
+            self.logger.warning(f'Reordering graph vertices ({self.reorder})...')
+            self.progress.start('reordering')
+            graph = relabel_graph(graph, get_ordering(graph, self.reorder, root))
+
+        graph.graph['generation'] = time.time_ns()
+        graph.graph['format'] = self.plain_format
+        if self.storage == 'compressed':
+            self.logger.warning('Compressing graph...')
+            self.progress.start('compressing')
+            graph = CompressedAdjacency.from_graph(graph)
+
+        return graph
+
+    def set_graph(self, graph: Union[nx.Graph, CompressedAdjacency]):
+        """
+        Install a graph, picking up the vertex permutation if the graph was reordered.
+        Reordered graphs keep actor IDs in graph.graph['external_ids'], indexed by internal vertex ID.
+        Compressed graphs are always numbered densely and keep the IDs in graph.external_ids,
+        they look actors up themselves (see CompressedAdjacency.vertex).
+        """
+        self.graph = graph
+        if isinstance(graph, CompressedAdjacency):
+            self.external_ids = graph.external_ids
+            self.neighbors = graph.neighbors
+            self.generation = graph.generation
+        else:
+            self.external_ids = graph.graph.get('external_ids')
+            self.generation = graph.graph.get('generation')
+            self.neighbors = graph._adj.__getitem__     # Iterating adjacency dict gives neighbors.
+
+        if self.external_ids is None or isinstance(graph, CompressedAdjacency):
+            self.internal_ids = None
+        else:
+            self.internal_ids = {actor_id: i for i, actor_id in enumerate(self.external_ids)}
+
+    def size_in_bytes(self) -> int:
+        """Approximate memory taken by the graph, 0 until it is ready."""
+        if not self.ready:
+            return 0
+        if isinstance(self.graph, CompressedAdjacency):
+            return self.graph.size_in_bytes()
+        return self.graph.number_of_edges() * self.plain_bytes_per_edge
+
+    def to_internal(self, actor_id: int) -> Optional[int]:
+        if isinstance(self.graph, CompressedAdjacency):
+            return self.graph.vertex(actor_id)
+        if self.internal_ids is None:
+            return actor_id
+        return self.internal_ids.get(actor_id)
+
+    def to_external(self, vertices: Iterable[int]) -> List[int]:
+        if self.external_ids is None:
+            return list(vertices)
+        return [self.external_ids[v] for v in vertices]
+
+    def actor_ids(self) -> List[int]:
+        return self.to_external(self.graph)
+
+    def get_path(self, src: int, dst: int, edge_filter: Optional[EdgeFilter] = None, max_dist: Optional[int] = None,
+                 stats: Optional[SearchStats] = None):
+        """
+        Shortest path between actors, empty if they are not connected. Raises SearchLimitError
+        if the path is longer than `max_dist` or the search exceeds the budget.
+        Fills in `stats` if given.
+        """
+        src = self.to_internal(src)
+        dst = self.to_internal(dst)
+        if src is None or dst is None:
+            return []
+        if src not in self.graph or dst not in self.graph:  # Isolated single nodes are not added.
+            return []
+
+        neighbors = self.neighbors if edge_filter is None else self.filtered_neighbors(edge_filter)
+        return self.to_external(bidirectional_bfs(neighbors, src, dst, max_dist, self.search_budget, stats))
+
+    def get_shortest_paths(self, src: int, dst: int, edge_filter: Optional[EdgeFilter] = None,
+                           max_dist: Optional[int] = None, stats: Optional[SearchStats] = None) -> ShortestPaths:
+        """Number of shortest paths between actors and a lazy iterator over them. Limits as in get_path."""
+        src = self.to_internal(src)
+        dst = self.to_internal(dst)
+        if src is None or dst is None or src not in self.graph or dst not in self.graph:
+            return ShortestPaths(-1, 0, iter([]))
+
+        neighbors = self.neighbors if edge_filter is None else self.filtered_neighbors(edge_filter)
+        result = shortest_paths(neighbors, src, dst, max_dist, self.search_budget, stats)
+        return result._replace(paths=map(self.to_external, result.paths))
 
+    def filtered_neighbors(self, edge_filter: EdgeFilter) -> Callable[[int], Iterable[int]]:
+        """Neighbors function skipping edges the filter disallows."""
+        if isinstance(self.graph, CompressedAdjacency):
+            graph = self.graph
+            return lambda v: graph.filtered_neighbors(v, edge_filter)
+
+        adj = self.graph._adj
+        allows = edge_filter.allows
+        return lambda v: [u for u, attrs in adj[v].items()
+                          if allows(attrs['min_year'], attrs['max_year'], attrs['genres'], attrs['languages'])]
+
+    def get_path_movies(self, path: List[int]) -> List[Optional[int]]:
+        """IDs of movies linking consecutive actors of a path returned by get_path."""
+        vertices = [self.to_internal(actor_id) for actor_id in path]
+        if isinstance(self.graph, CompressedAdjacency):
+            return [self.graph.edge_movie(v, u) for v, u in zip(vertices, vertices[1:])]
+        else:
+            return [self.graph._adj[v][u].get('movie') for v, u in zip(vertices, vertices[1:])]
+
+    def get_distance_matrix(self, sources: List[int], targets: List[int]) -> List[List[int]]:
+        """Distances between every source and every target actor, -1 if there is no path."""
+        vertices = self.to_vertices(sources)
+        present = [i for i, v in enumerate(vertices) if v is not None]
+        rows = distance_matrix(self.neighbors, [vertices[i] for i in present], self.to_vertices(targets))
+
+        result = [[-1] * len(targets) for _ in sources]
+        for i, row in zip(present, rows):
+            result[i] = row
         return result
+
+    def get_distance_histograms(self, sources: List[int]) -> List[List[int]]:
+        """For every source actor, numbers of actors at distance 0, 1, 2, ... from it."""
+        vertices = self.to_vertices(sources)
+        present = [i for i, v in enumerate(vertices) if v is not None]
+        histograms = distance_histograms(self.neighbors, [vertices[i] for i in present])
+
+        result = [[] for _ in sources]     # type: List[List[int]]
+        for i, histogram in zip(present, histograms):
+            result[i] = histogram
+        return result
+
+    def to_vertices(self, actor_ids: List[int]) -> List[Optional[int]]:
+        """Internal vertex IDs of the actors, None for actors missing from the graph."""
+        result = []
+        for actor_id in actor_ids:
+            v = self.to_internal(actor_id)
+            result.append(v if v is not None and v in self.graph else None)
+        return result
+
+
+def bidirectional_bfs(neighbors: Callable[[int], Iterable[int]], src: int, dst: int,
+                      max_dist: Optional[int] = None, budget: Optional[int] = None,
+                      stats: Optional[SearchStats] = None) -> List[int]:
+    """
+    Shortest path between two vertices, or an empty list if there is none. Searches from both
+    ends, each step expanding a whole level of the smaller frontier.
+
+    Stops with DistanceLimitError when the path is known to be longer than `max_dist`,
+    and with BudgetExceededError after expanding `budget` vertices.
+    """
+    if src == dst:
+        return [src]
+    if max_dist is not None and max_dist < 1:
+        raise DistanceLimitError(max_dist)
+
+    pred = {src: None}
+    succ = {dst: None}
+    forward = [src]
+    backward = [dst]
+    depth = 0       # Sum of depths of both searches: there are no paths of this length or shorter.
+    expanded = 0
+
+    try:
+        while forward and backward:
+            if len(forward) <= len(backward):
+                frontier, forward = forward, []
+                for v in frontier:
+                    if expanded == budget:
+                        raise BudgetExceededError(depth)
+                    expanded += 1
+                    for u in neighbors(v):
+                        if u not in pred:
+                            pred[u] = v
+                            if u in succ:
+                                return join_path(pred, succ, u)
+                            forward.append(u)
+            else:
+                frontier, backward = backward, []
+                for v in frontier:
+                    if expanded == budget:
+                        raise BudgetExceededError(depth)
+                    expanded += 1
+                    for u in neighbors(v):
+                        if u not in succ:
+                            succ[u] = v
+                            if u in pred:
+                                return join_path(pred, succ, u)
+                            backward.append(u)
+
+            depth += 1
+            if max_dist is not None and depth >= max_dist and forward and backward:
+                raise DistanceLimitError(max_dist)
+
+        return []
+    finally:
+        if stats is not None:
+            stats.expanded = expanded
+
+
+def shortest_paths(neighbors: Callable[[int], Iterable[int]], src: int, dst: int,
+                   max_dist: Optional[int] = None, budget: Optional[int] = None,
+                   stats: Optional[SearchStats] = None) -> ShortestPaths:
+    """
+    All shortest paths between two vertices, counted without enumerating them.
+
+    Bidirectional BFS like bidirectional_bfs, but levels are always expanded completely, and
+    every reached vertex gets the number of shortest paths to it from the origin of its search
+    (Python ints, so the counts never overflow). Once the searches meet, every shortest path
+    goes through exactly one vertex of the level just reached, so the total is the sum of
+    products of the counts of both searches over these vertices. Paths are then enumerated
+    lazily from the levels of both searches. Neighbors of a vertex are scanned for the
+    enumeration once, however many paths go through it, and counted in `stats` as expanded.
+    """
+    if src == dst:
+        return ShortestPaths(0, 1, iter([[src]]))
+    if max_dist is not None and max_dist < 1:
+        raise DistanceLimitError(max_dist)
+
+    stats = stats or SearchStats()
+    stats.expanded = 0
+    dist_f = {src: 0}
+    count_f = {src: 1}
+    dist_b = {dst: 0}
+    count_b = {dst: 1}
+    forward = [src]
+    backward = [dst]
+    depth = 0   # Sum of depths of both searches, as in bidirectional_bfs.
+
+    while forward and backward:
+        if len(forward) <= len(backward):
+            forward = expand_level(neighbors, forward, dist_f, count_f, stats, budget, depth)
+            meeting = [u for u in forward if u in dist_b]
+        else:
+            backward = expand_level(neighbors, backward, dist_b, count_b, stats, budget, depth)
+            meeting = [u for u in backward if u in dist_f]
+
+        depth += 1
+        if meeting:
+            count = sum(count_f[u] * count_b[u] for u in meeting)
+            return ShortestPaths(depth, count, enumerate_paths(neighbors, meeting, dist_f, dist_b, stats))
+        if max_dist is not None and depth >= max_dist and forward and backward:
+            raise DistanceLimitError(max_dist)
+
+    return ShortestPaths(-1, 0, iter([]))
+
+
+def expand_level(neighbors: Callable[[int], Iterable[int]], frontier: List[int], dist: Dict[int, int],
+                 counts: Dict[int, int], stats: SearchStats, budget: Optional[int], depth: int) -> List[int]:
+    """Reach the next level of a search from `frontier`, accumulating path counts. Returns the new level."""
+    level = dist[frontier[0]] + 1
+    result = []
+    for v in frontier:
+        if stats.expanded == budget:
+            raise BudgetExceededError(depth)
+        stats.expanded += 1
+        paths = counts[v]
+        for u in neighbors(v):
+            d = dist.get(u)
+            if d is None:
+                dist[u] = level
+                counts[u] = paths
+                result.append(u)
+            elif d == level:
+                counts[u] += paths
+    return result
+
+
+def enumerate_paths(neighbors: Callable[[int], Iterable[int]], meeting: List[int],
+                    dist_f: Dict[int, int], dist_b: Dict[int, int], stats: SearchStats) -> Iterator[List[int]]:
+    closer_f = {}   # type: Dict[int, List[int]]
+    closer_b = {}   # type: Dict[int, List[int]]
+    for middle in meeting:
+        for head in half_paths(neighbors, middle, dist_f, closer_f, stats):
+            for tail in half_paths(neighbors, middle, dist_b, closer_b, stats):
+                yield head[::-1] + tail[1:]
+
+
+def half_paths(neighbors: Callable[[int], Iterable[int]], v: int, dist: Dict[int, int],
+               closer: Dict[int, List[int]], stats: SearchStats) -> Iterator[List[int]]:
+    """
+    Shortest paths from v to the origin of the search that found distances `dist`, v first.
+    Every vertex one step closer to the origin leads to it, so no branch is a dead end.
+    Such neighbors are found on the first visit of a vertex and kept in `closer`.
+    """
+    d = dist[v]
+    if d == 0:
+        yield [v]
+        return
+    steps = closer.get(v)
+    if steps is None:
+        stats.expanded += 1
+        steps = closer[v] = [u for u in neighbors(v) if dist.get(u) == d - 1]
+    for u in steps:
+        for rest in half_paths(neighbors, u, dist, closer, stats):
+            yield [v] + rest
+
+
+def join_path(pred: Dict[int, Optional[int]], succ: Dict[int, Optional[int]], middle: int) -> List[int]:
+    path = []
+    v = middle
+    while v is not None:
+        path.append(v)
+        v = pred[v]
+    path.reverse()
+
+    v = succ[middle]
+    while v is not None:
+        path.append(v)
+        v = succ[v]
+
+    return path
+
+
+def get_ordering(graph: nx.Graph, method: str, root: Optional[int] = None) -> List[int]:
+    """
+    Return graph nodes in the order they should be numbered, so that nodes visited
+    together by a search are also close together in memory.
+    """
+    if method == 'bfs':
+        return bfs_ordering(graph, root)
+    elif method == 'rcm':
+        return list(reverse_cuthill_mckee_ordering(graph))
+    elif method == 'degree':
+        return sorted(graph, key=graph.degree, reverse=True)
+    else:
+        raise ValueError(f'Unknown graph ordering: {method}')
+
+
+def bfs_ordering(graph: nx.Graph, root: Optional[int] = None) -> List[int]:
+    """
+    Breadth-first order starting from the root (usually the Bacon node), with neighbors
+    enqueued by descending degree. Components unreachable from the root follow, hubs first.
+    """
+    order = []
+    visited = set()
+    starts = sorted(graph, key=graph.degree, reverse=True)
+    if root is not None and root in graph:
+        starts.insert(0, root)
+
+    for start in starts:
+        if start in visited:
+            continue
+        visited.add(start)
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for peer in sorted(graph[node], key=graph.degree, reverse=True):
+                if peer not in visited:
+                    visited.add(peer)
+                    queue.append(peer)
+
+    return order
+
+
+def relabel_graph(graph: nx.Graph, order: List[int]) -> nx.Graph:
+    """
+    Renumber nodes to 0..N-1 following the given order. Unlike nx.relabel_nodes, nodes
+    and their adjacency are inserted in the new order, so the adjacency dicts are allocated
+    in that order, too. Edge attribute dicts are reused, so interned ones stay shared.
+    """
+    mapping = {node: i for i, node in enumerate(order)}
+    result = nx.Graph(external_ids=list(order))
+    result.add_nodes_from(range(len(order)))
+    adj = result._adj
+    for i, node in enumerate(order):
+        for peer, attrs in graph._adj[node].items():
+            j = mapping[peer]
+            if j > i:
+                adj[i][j] = adj[j][i] = attrs
+
+    return result
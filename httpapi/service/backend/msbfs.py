@@ -0,0 +1,98 @@
+"""
+Multi-source bit-parallel BFS (MS-BFS).
+
+Up to `batch_size` searches run simultaneously: every vertex keeps a bitset of the sources
+that have reached it, so a single scan of a vertex's neighbors advances all searches
+that have this vertex in their frontier. The cost of a batch is close to the cost of one BFS.
+"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+
+Neighbors = Callable[[int], Iterable[int]]
+batch_size = 64     # Sources per batch, i.e. bits in a vertex bitset.
+
+
+def multi_source_bfs(neighbors: Neighbors, sources: List[int]) -> Iterator[Tuple[int, Dict[int, int]]]:
+    """
+    Run BFS from up to `batch_size` sources at once. Yields (distance, visited) for every level,
+    where `visited` maps vertices first reached at this distance to the bitset of sources
+    (bit i for sources[i]) that reached them.
+    """
+    if len(sources) > batch_size:
+        raise ValueError(f'At most {batch_size} sources per batch, got {len(sources)}')
+
+    seen = {}   # type: Dict[int, int]
+    for i, source in enumerate(sources):
+        seen[source] = seen.get(source, 0) | 1 << i
+
+    frontier = dict(seen)
+    distance = 0
+    while frontier:
+        yield distance, frontier
+        distance += 1
+        visited = {}
+        for v, bits in frontier.items():
+            for u in neighbors(v):
+                new = bits & ~seen.get(u, 0)
+                if new:
+                    visited[u] = visited.get(u, 0) | new
+
+        for u, bits in visited.items():
+            seen[u] = seen.get(u, 0) | bits
+        frontier = visited
+
+
+def distance_matrix(neighbors: Neighbors, sources: List[int], targets: List[int]) -> List[List[int]]:
+    """Distances from every source to every target, -1 for unreachable targets."""
+    target_index = {}   # type: Dict[int, List[int]]
+    for j, target in enumerate(targets):
+        target_index.setdefault(target, []).append(j)
+
+    result = []
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        rows = [[-1] * len(targets) for _ in batch]
+        remaining = len(batch) * len(target_index)
+        for distance, visited in multi_source_bfs(neighbors, batch):
+            for vertex, bits in visited.items():
+                columns = target_index.get(vertex)
+                if columns is None:
+                    continue
+                for i in iterate_bits(bits):
+                    for j in columns:
+                        rows[i][j] = distance
+                    remaining -= 1
+            if remaining == 0:      # All targets are reached, no need to traverse the rest.
+                break
+        result.extend(rows)
+
+    return result
+
+
+def distance_histograms(neighbors: Neighbors, sources: List[int]) -> List[List[int]]:
+    """For every source, numbers of vertices at distance 0, 1, 2, ... from it."""
+    result = []
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        histograms = [[] for _ in batch]   # type: List[List[int]]
+        for distance, visited in multi_source_bfs(neighbors, batch):
+            for histogram in histograms:
+                histogram.append(0)
+            for bits in visited.values():
+                for i in iterate_bits(bits):
+                    histograms[i][distance] += 1
+        for histogram in histograms:
+            while histogram and histogram[-1] == 0:     # Searches finishing earlier than others.
+                histogram.pop()
+        result.extend(histograms)
+
+    return result
+
+
+def iterate_bits(bits: int) -> Iterator[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
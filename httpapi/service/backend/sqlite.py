@@ -0,0 +1,105 @@
+import json
+import asyncio
+import sqlite3
+from typing import Optional, List, Dict, Any
+from .db import Database
+from .filters import EdgeFilter
+
+
+class SqliteDatabase(Database):
+    """
+    Read-only snapshot of the database in a single SQLite file, made by init/db_to_snapshot.py.
+    Lets API instances run without Postgres: lookups are local disk reads by index, fast enough
+    to run on the event loop directly. Lists of IDs and names are passed as JSON arrays
+    (expanded with json_each) to stay clear of the limit on the number of query parameters.
+    """
+    batch_size = 10000  # Rows fetched at a time when iterating over actor pairs.
+
+    def __init__(self, fpath: str):
+        self.fpath = fpath
+        self.conn = None    # type: Optional[sqlite3.Connection]
+
+    async def init(self):
+        self.conn = sqlite3.connect(f'file:{self.fpath}?mode=ro', uri=True, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+    async def get_actor_id(self, actor_name: str) -> Optional[int]:
+        row = self.conn.execute('select id from actors where name = ?', (actor_name,)).fetchone()
+        return None if row is None else row[0]
+
+    async def get_actor_ids(self, actor_names: List[str]) -> Dict[str, int]:
+        result = self.conn.execute('select id, name from actors where name in (select value from json_each(?))',
+                                   (json.dumps(actor_names),))
+        return {row[1]: row[0] for row in result}
+
+    async def get_actor_names(self, actor_ids: List[int]) -> Dict[int, str]:
+        result = self.conn.execute('select id, name from actors where id in (select value from json_each(?))',
+                                   (json.dumps(actor_ids),))
+        return {row[0]: row[1] for row in result}
+
+    async def get_movie_titles(self) -> Dict[int, str]:
+        return {row[0]: row[1] for row in self.conn.execute('select id, name from movies')}
+
+    async def get_genres(self) -> Dict[str, int]:
+        return {row[0]: row[1] for row in self.conn.execute('select name, bit from genres')}
+
+    async def get_languages(self) -> Dict[str, int]:
+        return {row[0]: row[1] for row in self.conn.execute('select code, bit from languages')}
+
+    async def get_linking_movies(self, path: List[int], edge_filter: EdgeFilter) -> List[Optional[int]]:
+        result = self.conn.execute('''
+            select p.id1, p.id2, min(c1.movie_id)
+            from (
+                select a.value as id1, b.value as id2
+                from json_each(:ids1) a
+                join json_each(:ids2) b on b.key = a.key
+            ) p
+            join cast_data c1 on c1.actor_id = p.id1
+            join cast_data c2 on c2.actor_id = p.id2 and c2.movie_id = c1.movie_id
+            join movies m on m.id = c1.movie_id
+            where (:year_from is null or m.release_year >= :year_from)
+                and (:year_to is null or m.release_year <= :year_to)
+                and (:genres = 0 or m.genre_mask & :genres != 0)
+                and (:languages = 0 or m.language_mask & :languages != 0)
+            group by p.id1, p.id2
+        ''', {'ids1': json.dumps(path[:-1]), 'ids2': json.dumps(path[1:]), 'year_from': edge_filter.year_from,
+              'year_to': edge_filter.year_to, 'genres': edge_filter.genres, 'languages': edge_filter.languages})
+
+        movies = {(row[0], row[1]): row[2] for row in result}
+        return [movies.get(pair) for pair in zip(path, path[1:])]
+
+    async def get_actor_pairs(self):
+        cursor = self.conn.execute('select id1, id2, movie_id, min_year, max_year, genre_mask, language_mask '
+                                   'from peers where id1 < id2')
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+            await asyncio.sleep(0)  # Let other requests in between batches.
+
+    async def count_actor_pairs(self) -> int:
+        return self.conn.execute('select count(*) from peers where id1 < id2').fetchone()[0]
+
+    async def get_bacon_number(self, actor_id: int) -> Optional[int]:
+        row = self.conn.execute('select bn from bacon_numbers where actor_id = ?', (actor_id,)).fetchone()
+        return None if row is None else row[0]
+
+    async def get_centers(self, limit: int) -> List[Dict[str, Any]]:
+        result = self.conn.execute('''
+            select c.rank, a.name, c.closeness, c.avg_distance, c.eccentricity, c.harmonic, c.reached
+            from centrality c
+            join actors a on c.actor_id = a.id
+            order by c.rank
+            limit ?
+        ''', (limit,))
+        return [dict(row) for row in result]
+
+    async def table_exists(self, table_name: str) -> bool:
+        row = self.conn.execute("select 1 from sqlite_master where type = 'table' and name = ?",
+                                (table_name,)).fetchone()
+        return row is not None
+
+    async def close(self):
+        self.conn.close()
@@ -10,5 +10,22 @@ DEBUG_API_PORT = int(os.getenv('DEBUG_API_PORT', '8080'))
 DB_DSN = os.path.expandvars(os.getenv('DB_DSN', 'postgres://$DB_HOST:$DB_PORT/$DB_NAME'))
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_SNAPSHOT_PATH = os.getenv('DB_SNAPSHOT_PATH')   # SQLite snapshot to use instead of Postgres, if set.
 
 GRAPH_CACHE_PATH = os.getenv('GRAPH_CACHE_PATH')
+GRAPH_REORDER = os.getenv('GRAPH_REORDER')   # Vertex ordering applied at build time: bfs, rcm, degree or empty.
+GRAPH_STORAGE = os.getenv('GRAPH_STORAGE')   # Graph representation: plain (default) or compressed.
+SEARCH_BUDGET = int(os.getenv('SEARCH_BUDGET', '100000'))  # Max vertices expanded by a single search, 0 for no limit.
+MAX_PATHS = int(os.getenv('MAX_PATHS', '100'))     # Max shortest paths to enumerate for a single request.
+
+CACHE_MAX_AGE = int(os.getenv('CACHE_MAX_AGE', '3600'))   # Seconds clients and CDN may cache answers.
+# Answer plain /bn queries from the precomputed bacon_numbers table while the graph is loading.
+BN_TABLE_FALLBACK = os.getenv('BN_TABLE_FALLBACK', '1') == '1'
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))    # Requests at least this slow go to the slow-query log,
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', '1000'))   # which keeps this many latest ones.
+
+WS_MAX_IN_FLIGHT = int(os.getenv('WS_MAX_IN_FLIGHT', '1000'))  # Concurrent queries per WebSocket connection.
+
+DATASETS_PATH = os.getenv('DATASETS_PATH')    # Directory of additional datasets, loaded on first request.
+DATASETS_MEMORY_BUDGET_MB = int(os.getenv('DATASETS_MEMORY_BUDGET_MB', '1024'))  # Evict LRU datasets above this.
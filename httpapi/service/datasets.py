@@ -0,0 +1,109 @@
+import os
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional, Dict, List
+from .app import Application
+from .backend import ActorsGraph, SqliteDatabase
+from .backend.compressed import CompressedAdjacency
+
+
+class DatasetNotFoundError(Exception):
+    pass
+
+
+class DatasetLoadError(Exception):
+    pass
+
+
+class DatasetRegistry:
+    """
+    Additional datasets served by the same process, loaded on first request.
+
+    Every dataset is a subdirectory of `path` holding a DB snapshot (see init/db_to_snapshot.py)
+    and the graph dump, built from the snapshot on first use if missing. Compressed dumps are
+    memory-mapped, so loading one takes no time and only the pages searches touch are read.
+
+    When the graphs take more than `memory_budget` bytes, least recently used datasets are
+    evicted. They are dropped rather than closed: requests still using them finish, and
+    the memory is freed with the last reference. Graphs still being built are abandoned, though.
+    """
+    snapshot_file = 'snapshot.sqlite'
+    graph_file = 'graph.dump'
+    name_pattern = re.compile(r'^[\w-]+$')
+
+    def __init__(self, path: str, memory_budget: int, create_graph: Callable[[], ActorsGraph]):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.create_graph = create_graph
+        self.loaded = OrderedDict()     # type: Dict[str, Application]  # Least recently used first.
+        self.loading = {}   # type: Dict[str, asyncio.Task]
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def names(self) -> List[str]:
+        if not self.path or not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if self.exists(name))
+
+    def exists(self, name: str) -> bool:
+        return bool(self.path) and self.name_pattern.match(name) is not None \
+            and os.path.exists(os.path.join(self.path, name, self.snapshot_file))
+
+    async def get(self, name: str) -> Application:
+        app = self.loaded.get(name)
+        if app is not None:
+            self.loaded.move_to_end(name)
+            self.evict()    # Graphs built in background grow after loading.
+            return app
+
+        task = self.loading.get(name)
+        if task is None:
+            if not self.exists(name):
+                raise DatasetNotFoundError(name)
+            task = asyncio.create_task(self.load(name))
+            self.loading[name] = task
+
+        # Requests for the dataset wait for the same load, which must not be cancelled with any of them.
+        return await asyncio.shield(task)
+
+    def generation(self, name: str) -> Optional[int]:
+        """Generation of the dataset's graph (see ActorsGraph.generation) without loading it, None if unknown."""
+        app = self.loaded.get(name)
+        if app is not None:
+            return app.generation
+        if not self.exists(name):
+            return None
+        return CompressedAdjacency.read_generation(os.path.join(self.path, name, self.graph_file))
+
+    async def load(self, name: str) -> Application:
+        self.logger.warning(f'Loading dataset {name}...')
+        try:
+            dataset_path = os.path.join(self.path, name)
+            db = SqliteDatabase(os.path.join(dataset_path, self.snapshot_file))
+            app = Application(db, self.create_graph(), os.path.join(dataset_path, self.graph_file))
+            await app.init(wait_for_graph=True)
+            self.loaded[name] = app
+            self.evict()
+            return app
+        except Exception as e:
+            self.logger.exception(f'Dataset {name} could not be loaded')
+            raise DatasetLoadError(name) from e
+        finally:
+            del self.loading[name]
+
+    def memory_usage(self) -> int:
+        return sum(app.graph.size_in_bytes() for app in self.loaded.values())
+
+    def evict(self):
+        while len(self.loaded) > 1 and self.memory_usage() > self.memory_budget:
+            name, app = self.loaded.popitem(last=False)
+            app.cancel_graph_task()     # Otherwise the next request would start another build.
+            self.logger.warning(f'Dataset {name} was evicted')
+
+    async def close(self):
+        for task in list(self.loading.values()):
+            task.cancel()
+        while self.loaded:
+            _, app = self.loaded.popitem()
+            await app.close()
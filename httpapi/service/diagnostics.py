@@ -0,0 +1,151 @@
+"""
+Opt-in diagnostics of the search hot path: a sampling profiler and a slow-query log.
+
+The profiler is a thread taking stacks of all other threads with sys._current_frames()
+at a fixed interval, so the profiled code runs unmodified and the overhead is paid by the
+sampler only. Stacks are returned in collapsed format ("thread;outer;...;inner count"
+per line), accepted by flamegraph.pl, speedscope and similar tools.
+
+Slow queries are traced through a context variable: endpoints open a trace, the application
+code below marks stages and adds details to it if there is one.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.counts = Counter()     # type: Counter
+        self.samples = 0
+        self.thread = None  # type: Optional[threading.Thread]
+        self.stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        """Sample stacks for a while, return them collapsed."""
+        self.start(interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stop()
+        return self.collapsed()
+
+    def start(self, interval: float):
+        if self.running:
+            raise RuntimeError('Profiler is already running')
+        self.counts = Counter()
+        self.samples = 0
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,), name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self, interval: float):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+class QueryTrace:
+    """Timings and details of a single request."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}    # type: Dict[str, float]
+        self.details = {}   # type: Dict[str, Any]
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class SlowQueryLog:
+    """Keeps the latest `size` requests that took at least `threshold_ms`."""
+
+    def __init__(self, threshold_ms: float, size: int):
+        self.threshold_ms = threshold_ms
+        self.entries = deque(maxlen=size)
+
+    @contextmanager
+    def trace(self, endpoint: str):
+        trace = QueryTrace(endpoint)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            current_trace.reset(token)
+            self.record(trace)
+
+    def record(self, trace: QueryTrace):
+        elapsed_ms = trace.elapsed() * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        self.entries.append({
+            'time': time.time(),
+            'endpoint': trace.endpoint,
+            'total_ms': round(elapsed_ms, 3),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in trace.stages.items()},
+            **trace.details,
+        })
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """Entries, the latest first."""
+        return list(reversed(self.entries))
+
+
+current_trace = ContextVar('current_trace', default=None)     # type: ContextVar[Optional[QueryTrace]]
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request, if it is traced."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+    else:
+        with trace.stage(name):
+            yield
+
+
+def annotate(**details):
+    """Add details to the current request's slow-query log entry, if it is traced."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.details.update(details)
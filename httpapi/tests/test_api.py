@@ -1,16 +1,21 @@
+import time
 import random
+import asyncio
+import msgpack
+import pytest
 from fastapi.testclient import TestClient
 from service import api
 from utils import get_random_string
-from unittest.mock import AsyncMock
-from service.app import Distance, ActorNotFoundError
+from unittest.mock import AsyncMock, Mock
+from service.app import Distance, Filters, ActorNotFoundError, InvalidFilterError
+from service.datasets import DatasetRegistry, DatasetLoadError
 
 
 client = TestClient(api.fapi)
 
 
 class ApplicationMock:
-    pass
+    generation = None
 
 
 # noinspection PyUnresolvedReferences
@@ -25,7 +30,8 @@ def test_bn_ok():
     result = response.json()
     assert result['dist'] == distance.length
     assert result['path'] == distance.path
-    api.app.get_bacon_dist.assert_awaited_once_with(actor_name, True)
+    assert result['movies'] == distance.movies
+    api.app.get_bacon_dist.assert_awaited_once_with(actor_name, True, None, None)
 
 
 # noinspection PyUnresolvedReferences
@@ -41,7 +47,7 @@ def test_dist_ok():
     result = response.json()
     assert result['dist'] == distance.length
     assert result['path'] == distance.path
-    api.app.get_actor_dist_by_name.assert_awaited_once_with(name1, name2, True)
+    api.app.get_actor_dist_by_name.assert_awaited_once_with(name1, name2, True, None, None, 0, False)
 
 
 def test_bn_404():
@@ -52,7 +58,7 @@ def test_bn_404():
     response = client.get(f'/bn?name=XXX&path=true')
 
     assert response.status_code == 404
-    app.get_bacon_dist.assert_called_once_with('XXX', True)
+    app.get_bacon_dist.assert_called_once_with('XXX', True, None, None)
 
 
 def test_dist_404():
@@ -63,15 +69,377 @@ def test_dist_404():
     response = client.get(f'/dist?name1=XXX&name2=YYY&path=true')
 
     assert response.status_code == 404
-    app.get_actor_dist_by_name.assert_called_once_with('XXX', 'YYY', True)
+    app.get_actor_dist_by_name.assert_called_once_with('XXX', 'YYY', True, None, None, 0, False)
+
+
+# noinspection PyUnresolvedReferences
+def test_dist_filtered():
+    api.app = get_randomized_application_mock()
+
+    response = client.get('/dist?name1=XXX&name2=YYY&year_from=2000&genre=Drama&genre=Comedy&language=en')
+
+    assert response.status_code == 200
+    api.app.get_actor_dist_by_name.assert_awaited_once_with(
+        'XXX', 'YYY', False, Filters(year_from=2000, genres=['Drama', 'Comedy'], languages=['en']), None, 0, False)
+
+
+@pytest.mark.parametrize('query', ['year_from=40000', 'year_to=-1'])
+def test_dist_invalid_year(query):
+    api.app = get_randomized_application_mock()
+
+    response = client.get(f'/dist?name1=XXX&name2=YYY&path=true&{query}')
+
+    assert response.status_code == 422
+    api.app.get_actor_dist_by_name.assert_not_called()
+
+
+def test_bn_400():
+    app = ApplicationMock()
+    app.get_bacon_dist = AsyncMock(side_effect=InvalidFilterError('Unknown genre: XXX'))
+    api.app = app
+
+    response = client.get('/bn?name=YYY&genre=XXX')
+
+    assert response.status_code == 400
+    app.get_bacon_dist.assert_called_once_with('YYY', False, Filters(genres=['XXX']), None)
+
+
+def test_bn_farther_than():
+    app = ApplicationMock()
+    app.get_bacon_dist = AsyncMock(return_value=Distance(None, farther_than=3))
+    api.app = app
+
+    response = client.get('/bn?name=XXX&max_dist=3')
+
+    assert response.status_code == 200
+    assert response.json() == {'dist': None, 'farther_than': 3}
+    app.get_bacon_dist.assert_called_once_with('XXX', False, None, 3)
+
+
+def test_dist_budget_exceeded():
+    app = ApplicationMock()
+    app.get_actor_dist_by_name = AsyncMock(return_value=Distance(None, farther_than=4, budget_exceeded=True))
+    api.app = app
+
+    response = client.get('/dist?name1=XXX&name2=YYY&path=true')
+
+    assert response.status_code == 200
+    assert response.json() == {'dist': None, 'farther_than': 4, 'budget_exceeded': True}
+
+
+# noinspection PyUnresolvedReferences
+def test_bn_etag():
+    api.app = get_randomized_application_mock()
+    api.app.generation = 0xabc
+
+    response = client.get('/bn?name=XXX')
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{api.fapi.version}-abc"'
+    assert 'max-age' in response.headers['Cache-Control']
+    api.app.get_bacon_dist.assert_awaited_once()
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.parametrize('if_none_match', ['"{}-abc"', 'W/"{}-abc"', '"xxx", "{}-abc"', '*'])
+def test_dist_not_modified(if_none_match):
+    api.app = get_randomized_application_mock()
+    api.app.generation = 0xabc
+
+    response = client.get('/dist?name1=XXX&name2=YYY', headers={'If-None-Match': if_none_match.format(api.fapi.version)})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == f'"{api.fapi.version}-abc"'
+    api.app.get_actor_dist_by_name.assert_not_awaited()
+
+
+# noinspection PyUnresolvedReferences
+def test_dist_modified():
+    api.app = get_randomized_application_mock()
+    api.app.generation = 0xabd
+
+    response = client.get('/dist?name1=XXX&name2=YYY', headers={'If-None-Match': f'"{api.fapi.version}-abc"'})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{api.fapi.version}-abd"'
+    api.app.get_actor_dist_by_name.assert_awaited_once()
 
 
 def get_randomized_application_mock():
     app = ApplicationMock()
     dist = random.randint(3, 9)
     mock_path = [get_random_string() for _ in range(dist + 1)]
-    mock_result = Distance(dist, mock_path)
+    mock_movies = [get_random_string() for _ in range(dist)]
+    mock_result = Distance(dist, mock_path, mock_movies)
     app.get_bacon_dist = AsyncMock(return_value=mock_result)
     app.get_actor_dist_by_name = AsyncMock(return_value=mock_result)
 
     return app
+
+
+def test_distance_matrix_ok():
+    app = ApplicationMock()
+    app.get_distance_matrix = AsyncMock(return_value=[[0, 2], [2, 0]])
+    api.app = app
+
+    response = client.get('/admin/distances?names=XXX&names=YYY')
+
+    assert response.status_code == 200
+    assert response.json() == {'sources': ['XXX', 'YYY'], 'targets': ['XXX', 'YYY'], 'dist': [[0, 2], [2, 0]]}
+    app.get_distance_matrix.assert_awaited_once_with(['XXX', 'YYY'], None)
+
+
+def test_distance_histograms_ok():
+    app = ApplicationMock()
+    app.get_distance_histograms = AsyncMock(return_value=[[1, 5, 7], [1, 3]])
+    api.app = app
+
+    response = client.get('/admin/distances?names=XXX&names=YYY&histogram=true')
+
+    assert response.status_code == 200
+    assert response.json() == {'histograms': {'XXX': [1, 5, 7], 'YYY': [1, 3]}}
+    app.get_distance_histograms.assert_awaited_once_with(['XXX', 'YYY'])
+
+
+def test_centers_ok():
+    app = ApplicationMock()
+    centers = [{'rank': 1, 'name': get_random_string(), 'closeness': 0.3, 'avg_distance': 3.1,
+                'eccentricity': 9, 'harmonic': 0.35, 'reached': 100000}]
+    app.get_centers = AsyncMock(return_value=centers)
+    api.app = app
+
+    response = client.get('/centers?limit=1')
+
+    assert response.status_code == 200
+    assert response.json() == {'centers': centers}
+    app.get_centers.assert_awaited_once_with(1)
+
+
+@pytest.mark.parametrize('limit', [-1, 0, 1001])
+def test_centers_invalid_limit(limit):
+    api.app = ApplicationMock()
+
+    response = client.get(f'/centers?limit={limit}')
+
+    assert response.status_code == 422
+
+
+def test_healthz():
+    response = client.get('/healthz')
+
+    assert response.status_code == 200
+
+
+def test_readyz_loading():
+    app = ApplicationMock()
+    app.get_status = Mock(return_value={'ready': False, 'stage': 'building', 'done': 50, 'total': 200,
+                                        'retry_after': 12})
+    api.app = app
+
+    response = client.get('/readyz')
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '12'
+    assert response.json()['done'] == 50
+
+
+def test_readyz_failed():
+    app = ApplicationMock()
+    app.get_status = Mock(return_value={'ready': False, 'stage': 'loading', 'done': 0, 'total': 8,
+                                        'error': 'Unsupported graph dump format'})
+    api.app = app
+
+    response = client.get('/readyz')
+
+    assert response.status_code == 500
+    assert 'Retry-After' not in response.headers
+    assert response.json()['error'] == 'Unsupported graph dump format'
+
+
+def test_readyz_ready():
+    app = ApplicationMock()
+    app.get_status = Mock(return_value={'ready': True, 'stage': 'loading', 'done': 200, 'total': 200})
+    api.app = app
+
+    response = client.get('/readyz')
+
+    assert response.status_code == 200
+    assert 'Retry-After' not in response.headers
+
+
+def test_slow_queries(monkeypatch):
+    api.app = get_randomized_application_mock()
+    monkeypatch.setattr(api.slow_log, 'threshold_ms', 0)
+
+    client.get('/dist?name1=XXX&name2=YYY&path=true')
+    response = client.get('/admin/slow-queries')
+
+    assert response.status_code == 200
+    entry = response.json()['queries'][0]
+    assert entry['endpoint'] == '/dist'
+    assert 'serialize' in entry['stages_ms']
+
+
+def test_profile():
+    response = client.get('/admin/profile?seconds=0.05&interval=0.001')
+
+    assert response.status_code == 200
+    assert 'profile.folded' in response.headers['Content-Disposition']
+
+
+# noinspection PyUnresolvedReferences
+def test_ws_out_of_order():
+    app = ApplicationMock()
+
+    async def get_bacon_dist(name, *_):
+        await asyncio.sleep(0.2 if name == 'slow' else 0)
+        return Distance(len(name))
+
+    app.get_bacon_dist = AsyncMock(side_effect=get_bacon_dist)
+    app.get_actor_dist_by_name = AsyncMock(return_value=Distance(3, ['A', 'B'], ['M']))
+    api.app = app
+
+    with client.websocket_connect('/ws') as ws:
+        ws.send_bytes(msgpack.packb({'id': 1, 'op': 'bn', 'name': 'slow'}))
+        ws.send_bytes(msgpack.packb([{'id': 'x', 'op': 'dist', 'name1': 'A', 'name2': 'B', 'path': True,
+                                      'genre': ['Drama'], 'max_dist': 5}]))
+        first = msgpack.unpackb(ws.receive_bytes())
+        second = msgpack.unpackb(ws.receive_bytes())
+
+    assert first == {'id': 'x', 'status': 200, 'result': {'dist': 3, 'path': ['A', 'B'], 'movies': ['M']}}
+    assert second == {'id': 1, 'status': 200, 'result': {'dist': 4}}
+    app.get_actor_dist_by_name.assert_awaited_once_with('A', 'B', True, Filters(genres=['Drama']), 5, 0, False)
+
+
+@pytest.mark.parametrize('request_, status', [
+    ({'id': 1, 'op': 'xx'}, 400),
+    ({'id': 1, 'op': 'bn'}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'max_dist': -1}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'genre': 'Drama'}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'language': [1]}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'year_from': '2000'}, 400),
+    ({'id': 1, 'op': 'bn', 'name': ['XXX']}, 400),
+    ({'id': 1, 'op': 'dist', 'name1': 'XXX', 'name2': ['x']}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'dataset': 5}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'max_dist': True}, 400),
+    ({'id': 1, 'op': 'dist', 'name1': 'XXX', 'name2': 'YYY', 'paths': True}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'year_to': False}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX', 'year_from': 40000}, 400),
+    ({'id': 1, 'op': 'bn', 'name': 'XXX'}, 404),
+])
+def test_ws_errors(request_, status):
+    app = ApplicationMock()
+    app.get_bacon_dist = AsyncMock(side_effect=ActorNotFoundError('XXX'))
+    api.app = app
+
+    with client.websocket_connect('/ws') as ws:
+        ws.send_bytes(msgpack.packb(request_))
+        response = msgpack.unpackb(ws.receive_bytes())
+
+    assert response['id'] == 1
+    assert response['status'] == status
+    assert response['error']
+
+
+def test_ws_text_message():
+    api.app = ApplicationMock()
+
+    with client.websocket_connect('/ws') as ws:
+        ws.send_text('{"id": 1, "op": "bn", "name": "XXX"}')
+        response = msgpack.unpackb(ws.receive_bytes())
+
+    assert response['status'] == 400
+    assert response['error']
+
+
+# noinspection PyUnresolvedReferences
+def test_ws_disconnect_cancels_queries():
+    app = ApplicationMock()
+    cancelled = asyncio.Event()
+
+    async def get_bacon_dist(*_):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    app.get_bacon_dist = AsyncMock(side_effect=get_bacon_dist)
+    api.app = app
+
+    with client.websocket_connect('/ws') as ws:
+        ws.send_bytes(msgpack.packb({'id': 1, 'op': 'bn', 'name': 'XXX'}))
+        while not app.get_bacon_dist.await_count:
+            time.sleep(0.01)
+
+    assert cancelled.is_set()
+
+
+# noinspection PyUnresolvedReferences
+def test_dist_dataset():
+    api.app = get_randomized_application_mock()
+    dataset_app = get_randomized_application_mock()
+    api.datasets = DatasetRegistry('', 0, lambda: None)
+    api.datasets.loaded['tv'] = dataset_app
+
+    response = client.get('/dist?name1=XXX&name2=YYY&dataset=tv')
+
+    assert response.status_code == 200
+    dataset_app.get_actor_dist_by_name.assert_awaited_once()
+    api.app.get_actor_dist_by_name.assert_not_awaited()
+
+
+# noinspection PyUnresolvedReferences
+def test_bn_dataset_not_modified_before_loading():
+    api.app = get_randomized_application_mock()
+    api.datasets = DatasetRegistry('', 0, lambda: None)
+    api.datasets.generation = Mock(return_value=0xabc)
+    api.datasets.get = AsyncMock()
+
+    response = client.get('/bn?name=XXX&dataset=tv', headers={'If-None-Match': f'"{api.fapi.version}-abc"'})
+
+    assert response.status_code == 304
+    api.datasets.generation.assert_called_once_with('tv')
+    api.datasets.get.assert_not_awaited()
+
+
+def test_bn_dataset_load_error():
+    api.app = get_randomized_application_mock()
+    api.datasets = DatasetRegistry('', 0, lambda: None)
+    api.datasets.get = AsyncMock(side_effect=DatasetLoadError('tv'))
+
+    response = client.get('/bn?name=XXX&dataset=tv')
+
+    assert response.status_code == 500
+    assert 'tv' in response.text
+
+
+def test_bn_unknown_dataset():
+    api.app = get_randomized_application_mock()
+    api.datasets = DatasetRegistry('', 0, lambda: None)
+
+    response = client.get('/bn?name=XXX&dataset=tv')
+
+    assert response.status_code == 404
+
+
+# noinspection PyUnresolvedReferences
+def test_dist_paths_count():
+    app = ApplicationMock()
+    paths = [['A', 'C', 'B'], ['A', 'D', 'B']]
+    app.get_actor_dist_by_name = AsyncMock(return_value=Distance(2, count=3**40, paths=paths))
+    api.app = app
+
+    response = client.get('/dist?name1=A&name2=B&paths=2&count=true')
+
+    assert response.status_code == 200
+    assert response.json() == {'dist': 2, 'count': str(3**40), 'paths': paths}
+    app.get_actor_dist_by_name.assert_awaited_once_with('A', 'B', False, None, None, 2, True)
+
+
+def test_dist_paths_over_limit():
+    api.app = get_randomized_application_mock()
+
+    response = client.get(f'/dist?name1=A&name2=B&paths={api.MAX_PATHS + 1}')
+
+    assert response.status_code == 422
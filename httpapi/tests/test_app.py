@@ -1,10 +1,12 @@
+import asyncio
 import pytest
 import random
-from service.app import Application
-from service.backend.db import Database
-from service.backend.graph import ActorsGraph
+from service.app import Application, Distance, Filters, InvalidFilterError, NotInitializedError, get_shared_bits
+from service.backend.filters import EdgeFilter
+from service.backend.db import PostgresDatabase
+from service.backend.graph import ActorsGraph, DistanceLimitError, BudgetExceededError, ShortestPaths
 from utils import get_random_string
-from unittest.mock import Mock, AsyncMock
+from unittest.mock import Mock, AsyncMock, ANY
 
 
 # noinspection PyUnresolvedReferences
@@ -20,8 +22,10 @@ async def test_get_bacon_dist():
 
     assert dist.length == len(mock_path_ids) - 1
     assert dist.path == mock_path_names
+    assert dist.movies == list(app.movies.values())
+    app.graph.get_path_movies.assert_called_once_with(mock_path_ids)
     app.db.get_actor_id.assert_awaited_once_with(actor_name)
-    app.graph.get_path.assert_called_once_with(app.bacon_id, mock_actor_id)
+    app.graph.get_path.assert_called_once_with(app.bacon_id, mock_actor_id, None, None, ANY)
     app.db.get_actor_names.assert_awaited_once_with(mock_path_ids)
 
 
@@ -40,10 +44,205 @@ async def test_get_actor_dist_by_name():
     assert dist.length == len(mock_path_ids) - 1
     assert dist.path == mock_path_names
     app.db.get_actor_ids.assert_awaited_once_with([name1, name2])
-    app.graph.get_path.assert_called_once_with(id1, id2)
+    app.graph.get_path.assert_called_once_with(id1, id2, None, None, ANY)
     app.db.get_actor_names.assert_awaited_once_with(mock_path_ids)
 
 
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+async def test_get_bacon_dist_filtered():
+    app = get_application_with_randomized_mock_dependencies()
+    app.genres = {'Drama': 0, 'Comedy': 3}
+    app.languages = {'en': 0, 'fr': 1}
+    app.db.get_linking_movies = AsyncMock(return_value=list(app.movies.keys()))
+    mock_path_ids = app.graph.get_path.return_value
+    filters = Filters(genres=['Comedy', 'Drama'])
+
+    dist = await app.get_bacon_dist(get_random_string(), True, filters)
+
+    edge_filter = EdgeFilter(genres=0b1001)
+    assert dist.movies == list(app.movies.values())
+    app.graph.get_path.assert_called_once_with(app.bacon_id, app.db.get_actor_id.return_value, edge_filter, None,
+                                               ANY)
+    app.db.get_linking_movies.assert_awaited_once_with(mock_path_ids, edge_filter)
+    app.graph.get_path_movies.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_bacon_dist_filtered_same_actor():
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph.get_path.return_value = [app.bacon_id]
+    app.db.get_actor_names.return_value = {app.bacon_id: 'Kevin Bacon'}
+    app.graph.get_path_movies.return_value = []
+    app.db.get_linking_movies = AsyncMock()
+
+    dist = await app.get_bacon_dist('Kevin Bacon', True, Filters(year_from=2000))
+
+    assert dist.length == 0
+    assert dist.movies == []
+    app.db.get_linking_movies.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_get_bacon_dist_invalid_filter():
+    app = get_application_with_randomized_mock_dependencies()
+
+    with pytest.raises(InvalidFilterError):
+        await app.get_bacon_dist(get_random_string(), False, Filters(genres=['XXX']))
+
+
+@pytest.mark.asyncio
+async def test_get_bacon_dist_shared_genre():
+    app = get_application_with_randomized_mock_dependencies()
+    app.genres = {'Drama': 0, 'Foreign': 30, 'TV Movie': 30}
+    app.shared_genres = get_shared_bits(app.genres)
+
+    assert app.shared_genres == {'Foreign', 'TV Movie'}
+    with pytest.raises(InvalidFilterError):
+        await app.get_bacon_dist(get_random_string(), False, Filters(genres=['Drama', 'Foreign']))
+    await app.get_bacon_dist(get_random_string(), False, Filters(genres=['Drama']))
+
+
+@pytest.mark.asyncio
+async def test_get_bacon_dist_shared_language():
+    app = get_application_with_randomized_mock_dependencies()
+    app.languages = {'en': 0, 'xx': 62, 'yy': 62}
+    app.shared_languages = {'xx', 'yy'}
+
+    with pytest.raises(InvalidFilterError):
+        await app.get_bacon_dist(get_random_string(), False, Filters(languages=['xx']))
+    await app.get_bacon_dist(get_random_string(), False, Filters(languages=['en']))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('filters', [
+    Filters(year_from=2000, year_to=2005),
+    Filters(genres=['Drama'], languages=['fr']),
+    Filters(year_from=2000, languages=['fr']),
+])
+async def test_get_bacon_dist_combined_filters(filters):
+    app = get_application_with_randomized_mock_dependencies()
+    app.genres = {'Drama': 0}
+    app.languages = {'fr': 1}
+
+    with pytest.raises(InvalidFilterError):
+        await app.get_bacon_dist(get_random_string(), False, filters)
+    app.graph.get_path.assert_not_called()
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+@pytest.mark.parametrize('error, budget_exceeded', [(DistanceLimitError, False), (BudgetExceededError, True)])
+async def test_get_bacon_dist_limited(error, budget_exceeded):
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph.get_path = Mock(side_effect=error(3))
+
+    dist = await app.get_bacon_dist(get_random_string(), True, max_dist=3)
+
+    assert dist == Distance(None, farther_than=3, budget_exceeded=budget_exceeded)
+    app.graph.get_path.assert_called_once_with(app.bacon_id, app.db.get_actor_id.return_value, None, 3, ANY)
+    app.db.get_actor_names.assert_not_awaited()
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+@pytest.mark.parametrize('max_dist, expected', [(None, Distance(2)), (1, Distance(None, farther_than=1))])
+async def test_get_bacon_dist_warming_up(max_dist, expected):
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph.ready = False
+    app.bn_table_fallback = True
+    app.db.get_bacon_number = AsyncMock(return_value=2)
+
+    dist = await app.get_bacon_dist(get_random_string(), False, max_dist=max_dist)
+
+    assert dist == expected
+    app.db.get_bacon_number.assert_awaited_once_with(app.db.get_actor_id.return_value)
+    app.graph.get_path.assert_not_called()
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+async def test_get_bacon_dist_warming_up_with_path():
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph.ready = False
+    app.bn_table_fallback = True
+    app.db.get_bacon_number = AsyncMock(return_value=2)
+    app.graph.progress.start('building', 1000)
+    app.graph.progress.started -= 10
+    app.graph.progress.done = 250
+
+    with pytest.raises(NotInitializedError) as e:
+        await app.get_bacon_dist(get_random_string(), True)
+
+    assert 30 <= e.value.args[0] <= 31   # 10 seconds per 250 edges, 750 to go.
+    app.db.get_bacon_number.assert_not_awaited()
+
+
+def test_retry_after():
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph.ready = False
+    assert app.retry_after() == app.startup_time
+
+    app.graph.progress.start('compressing')
+    assert app.retry_after() == app.retry_interval
+
+
+@pytest.mark.asyncio
+async def test_graph_load_failure(tmp_path):
+    dump_path = tmp_path / 'graph.dump'
+    dump_path.write_bytes(b'BNCSR003')    # Dump of an old version.
+    app = get_application_with_randomized_mock_dependencies()
+    app.graph = ActorsGraph()
+    app.graph_cache_path = str(dump_path)
+    for method in ['init', 'get_movie_titles', 'get_genres', 'get_languages']:
+        setattr(app.db, method, AsyncMock(return_value={}))
+    app.db.table_exists = AsyncMock(return_value=True)
+
+    await app.init()
+    await asyncio.wait([app.graph_task])
+
+    status = app.get_status()
+    assert not status['ready']
+    assert 'remove it to rebuild the graph' in status['error']
+    assert 'retry_after' not in status
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+async def test_get_actor_dist_paths():
+    app = get_application_with_randomized_mock_dependencies()
+    names_dict = app.db.get_actor_ids.return_value
+    name1, name2 = list(names_dict.keys())
+    id1, id2 = list(names_dict.values())
+    app.graph.get_shortest_paths = Mock(return_value=ShortestPaths(2, 5, iter([[id1, 7, id2], [id1, 8, id2]])))
+    app.db.get_actor_names = AsyncMock(return_value={id1: name1, id2: name2, 7: 'C', 8: 'D'})
+
+    dist = await app.get_actor_dist_by_name(name1, name2, False, paths=3, count=True)
+
+    assert dist == Distance(2, count=5, paths=[[name1, 'C', name2], [name1, 'D', name2]])
+    app.graph.get_shortest_paths.assert_called_once_with(id1, id2, None, None, ANY)
+    app.graph.get_path.assert_not_called()
+
+
+# noinspection PyUnresolvedReferences
+@pytest.mark.asyncio
+async def test_get_actor_dist_count_with_path():
+    app = get_application_with_randomized_mock_dependencies()
+    id1, id2 = list(app.db.get_actor_ids.return_value.values())
+    path_ids = [id1, 7, id2]
+    app.graph.get_shortest_paths = Mock(return_value=ShortestPaths(2, 2, iter([path_ids, [id1, 8, id2]])))
+    app.db.get_actor_names = AsyncMock(return_value={id_: get_random_string() for id_ in path_ids})
+
+    dist = await app.get_actor_dist_by_name(*app.db.get_actor_ids.return_value, True, count=True)
+
+    assert dist.length == 2
+    assert len(dist.path) == 3
+    assert dist.count == 2
+    assert dist.paths is None
+    app.db.get_actor_names.assert_awaited_once_with(path_ids)
+    app.graph.get_path_movies.assert_called_once_with(path_ids)
+
+
 def get_application_with_randomized_mock_dependencies():
     length = random.randint(3, 9)
     path_ids = [random.randint(1, 10000) for _ in range(length + 1)]
@@ -51,16 +250,20 @@ def get_application_with_randomized_mock_dependencies():
     pair_ids = [random.randint(1, 10000), random.randint(1, 10000)]
     pair_dict = {get_random_string(): i for i in pair_ids}
 
-    db = Database('', '', '')
+    db = PostgresDatabase('', '', '')
     db.get_actor_id = AsyncMock(return_value=random.randint(1, 10000))
     db.get_actor_ids = AsyncMock(return_value=pair_dict)
     db.get_actor_names = AsyncMock(return_value=path_dict)
 
+    movies = {i: get_random_string() for i in range(length)}
+
     graph = ActorsGraph()
     graph.get_path = Mock(return_value=path_ids)
+    graph.get_path_movies = Mock(return_value=list(movies.keys()))
     graph.ready = True
 
     app = Application(db, graph, '')
     app.bacon_id = random.randint(3, 9)
+    app.movies = movies
 
     return app
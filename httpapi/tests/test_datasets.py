@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import asyncio
+import pytest
+from service.backend import ActorsGraph
+from service.datasets import DatasetRegistry, DatasetNotFoundError, DatasetLoadError
+from test_sqlite import SCHEMA
+
+
+PAIRS = [(1, 2, 10, 1995, 1995, 1, 1), (2, 3, 20, 1993, 2005, 3, 3)]
+
+
+async def iterate_pairs():
+    for pair in PAIRS:
+        yield pair
+
+
+@pytest.fixture
+def datasets_path(tmp_path) -> str:
+    for name in ['film', 'tv']:
+        os.mkdir(tmp_path / name)
+        conn = sqlite3.connect(str(tmp_path / name / DatasetRegistry.snapshot_file))
+        conn.executescript(SCHEMA)
+        conn.close()
+    os.mkdir(tmp_path / 'empty')
+    return str(tmp_path)
+
+
+def create_graph() -> ActorsGraph:
+    return ActorsGraph(storage='compressed')
+
+
+@pytest.mark.asyncio
+async def test_load_on_first_request(datasets_path):
+    graph = create_graph()
+    await graph.build_from_pairs(iterate_pairs())
+    graph.save_to_disk(os.path.join(datasets_path, 'film', DatasetRegistry.graph_file))
+    registry = DatasetRegistry(datasets_path, 2**30, create_graph)
+
+    assert registry.names() == ['film', 'tv']
+    assert not registry.loaded
+    first, second = await asyncio.gather(registry.get('film'), registry.get('film'))
+
+    assert first is second
+    assert first.graph.ready    # Dump is loaded before the first request is served.
+    assert first.graph.generation == graph.generation
+    assert (await first.get_bacon_dist('Meg Ryan', True)).path == ['Kevin Bacon', 'Tom Hanks', 'Meg Ryan']
+    assert list(registry.loaded) == ['film']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name', ['empty', 'missing', '..', 'film/../tv'])
+async def test_unknown_dataset(datasets_path, name):
+    registry = DatasetRegistry(datasets_path, 2**30, create_graph)
+
+    with pytest.raises(DatasetNotFoundError):
+        await registry.get(name)
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction(datasets_path):
+    for name in ['film', 'tv']:
+        graph = create_graph()
+        await graph.build_from_pairs(iterate_pairs())
+        graph.save_to_disk(os.path.join(datasets_path, name, DatasetRegistry.graph_file))
+    registry = DatasetRegistry(datasets_path, 1, create_graph)    # Only the latest dataset fits.
+
+    film = await registry.get('film')
+    await registry.get('tv')
+
+    assert list(registry.loaded) == ['tv']
+    assert (await film.get_bacon_dist('Tom Hanks', False)).length == 1     # Evicted, but still usable.
+    assert await registry.get('film') is not film
+    assert list(registry.loaded) == ['film']
+
+
+@pytest.mark.asyncio
+async def test_eviction_cancels_build(datasets_path):
+    graph = create_graph()
+    await graph.build_from_pairs(iterate_pairs())
+    graph.save_to_disk(os.path.join(datasets_path, 'film', DatasetRegistry.graph_file))
+    registry = DatasetRegistry(datasets_path, 1, create_graph)
+
+    tv = await registry.get('tv')   # No dump, the graph is built in background.
+    tv.graph_task.cancel()
+    tv.graph_task = asyncio.create_task(asyncio.sleep(10))  # A build taking a while.
+    await registry.get('film')
+    await asyncio.sleep(0)
+
+    assert list(registry.loaded) == ['film']
+    assert tv.graph_task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_load_error(datasets_path):
+    with open(os.path.join(datasets_path, 'film', DatasetRegistry.graph_file), 'wb') as f:
+        f.write(b'BNCSR001')    # Dump of an old version.
+    registry = DatasetRegistry(datasets_path, 2**30, create_graph)
+
+    with pytest.raises(DatasetLoadError):
+        await registry.get('film')
+    assert not registry.loaded and not registry.loading
+
+
+@pytest.mark.asyncio
+async def test_generation_without_loading(datasets_path):
+    graph = create_graph()
+    await graph.build_from_pairs(iterate_pairs())
+    graph.save_to_disk(os.path.join(datasets_path, 'film', DatasetRegistry.graph_file))
+    registry = DatasetRegistry(datasets_path, 2**30, create_graph)
+
+    assert registry.generation('film') == graph.generation
+    assert registry.generation('tv') is None    # No dump yet.
+    assert registry.generation('missing') is None
+    assert not registry.loaded
+
+
+@pytest.mark.asyncio
+async def test_close(datasets_path):
+    registry = DatasetRegistry(datasets_path, 2**30, create_graph)
+    film = await registry.get('film')
+
+    await registry.close()
+    await asyncio.sleep(0)
+
+    assert not registry.loaded
+    assert film.graph_task.cancelled()  # Was building the graph, there is no dump.
+    with pytest.raises(sqlite3.ProgrammingError):   # Connection is closed.
+        await film.db.get_actor_id('Kevin Bacon')
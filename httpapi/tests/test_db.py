@@ -3,7 +3,7 @@ import pytest
 from typing import Dict
 from service.config import DB_DSN, DB_USER, DB_PASSWORD
 import asyncpg as apg
-from service.backend import Database
+from service.backend import Database, PostgresDatabase
 
 
 @pytest.fixture(scope='module')
@@ -15,7 +15,7 @@ async def conn():
 
 @pytest.fixture(scope='module')
 async def db():
-    db = Database(DB_DSN, username=DB_USER, password=DB_PASSWORD)
+    db = PostgresDatabase(DB_DSN, username=DB_USER, password=DB_PASSWORD)
     await db.init()
     yield db
     await db.close()
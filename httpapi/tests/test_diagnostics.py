@@ -0,0 +1,52 @@
+import time
+import pytest
+import threading
+from service.diagnostics import SamplingProfiler, SlowQueryLog, stage, annotate
+
+
+def test_slow_query_log():
+    log = SlowQueryLog(threshold_ms=10, size=2)
+
+    for sleep in [0.02, 0, 0.02, 0.02]:
+        with log.trace('/bn'):
+            with stage('search'):
+                time.sleep(sleep)
+            annotate(actor_ids=[1, 2], distance=3, expanded=100)
+
+    entries = log.dump()
+    assert len(entries) == 2    # The fast one is not logged, the first slow one is evicted.
+    assert entries[0]['endpoint'] == '/bn'
+    assert entries[0]['stages_ms']['search'] >= 20
+    assert entries[0]['total_ms'] >= entries[0]['stages_ms']['search']
+    assert entries[0]['actor_ids'] == [1, 2]
+    assert entries[0]['expanded'] == 100
+
+
+def test_not_traced():
+    with stage('search'):
+        annotate(distance=3)    # Nothing to record, nothing to fail.
+
+
+def busy_loop(stopped: threading.Event):
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+@pytest.mark.asyncio
+async def test_profiler():
+    profiler = SamplingProfiler()
+    stopped = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stopped,), name='busy')
+    thread.start()
+    try:
+        stacks = await profiler.profile(0.2, 0.005)
+    finally:
+        stopped.set()
+        thread.join()
+
+    assert not profiler.running
+    assert profiler.samples > 0
+    lines = stacks.splitlines()
+    busy = [line for line in lines if line.startswith('busy;') and 'busy_loop (test_diagnostics.py:' in line]
+    assert busy
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines)
@@ -0,0 +1,374 @@
+import asyncio
+import threading
+import pytest
+import networkx as nx
+from array import array
+from itertools import islice
+from collections import Counter
+from service.backend.graph import ActorsGraph, DistanceLimitError, BudgetExceededError, SearchStats, \
+    shortest_paths
+from service.backend.compressed import CompressedAdjacency, encode_gaps
+from service.backend.filters import EdgeFilter
+
+
+# 10 - 20 - 30 - 40,  20 - 50 - 40,  60 - 70 (separate component), with linking movie IDs,
+# years, genre and language masks.
+PAIRS = [
+    (10, 20, 1, 1990, 2005, 0b01, 0b1),
+    (20, 30, 2, 1990, 1990, 0b01, 0b1),
+    (30, 40, 3, 1995, 1995, 0b01, 0b1),
+    (20, 50, 4, 2001, 2010, 0b10, 0b1),
+    (50, 40, 5, 2001, 2001, 0b11, 0b10),
+    (60, 70, 6, 0, 0, 0, 0),
+]
+
+
+async def iterate_pairs(pairs):
+    for pair in pairs:
+        yield pair
+
+
+async def build_graph(reorder=None, root=None, storage=None) -> ActorsGraph:
+    graph = ActorsGraph(reorder=reorder, storage=storage)
+    await graph.build_from_pairs(iterate_pairs(PAIRS), root=root)
+    return graph
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+@pytest.mark.parametrize('reorder', [None, *ActorsGraph.orderings])
+async def test_get_path(reorder, storage):
+    graph = await build_graph(reorder, root=10, storage=storage)
+
+    path = graph.get_path(10, 40)
+    assert len(path) == 4
+    assert path[0] == 10 and path[-1] == 40
+    assert path[1] == 20 and path[2] in (30, 50)
+    assert graph.get_path(60, 70) == [60, 70]
+    assert graph.get_path(10, 70) == []
+    assert graph.get_path(10, 999) == []
+    assert graph.get_path(30, 30) == [30]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_get_path_movies(reorder, storage):
+    graph = await build_graph(reorder, root=10, storage=storage)
+
+    assert graph.get_path_movies([10, 20, 30, 40]) == [1, 2, 3]
+    assert graph.get_path_movies([40, 50, 20]) == [5, 4]
+    assert graph.get_path_movies([60]) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_get_path_filtered(reorder, storage):
+    graph = await build_graph(reorder, root=10, storage=storage)
+
+    assert graph.get_path(10, 40, EdgeFilter(year_from=2000)) == [10, 20, 50, 40]
+    assert graph.get_path(10, 40, EdgeFilter(year_to=1995)) == [10, 20, 30, 40]
+    assert graph.get_path(10, 40, EdgeFilter(year_from=2002)) == []
+    assert graph.get_path(10, 40, EdgeFilter(genres=0b01)) == [10, 20, 30, 40]
+    assert graph.get_path(20, 40, EdgeFilter(genres=0b10, languages=0b11)) == [20, 50, 40]
+    assert graph.get_path(10, 40, EdgeFilter(languages=0b10)) == []
+    assert graph.get_path(60, 70, EdgeFilter(year_from=1900)) == []    # Unknown years.
+    assert graph.get_path(60, 70, EdgeFilter()) == [60, 70]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_edge_labels_shared(reorder, tmp_path):
+    pairs = [(1, 2, 7, 2000, 2000, 1, 1), (1, 3, 7, 2000, 2000, 1, 1), (2, 3, 7, 2000, 2000, 1, 1),
+             (3, 4, 8, 2000, 2000, 1, 1)]
+    graph = ActorsGraph(reorder=reorder)
+    await graph.build_from_pairs(iterate_pairs(pairs))
+    fpath = str(tmp_path / 'graph.dump')
+    graph.save_to_disk(fpath)
+    loaded = ActorsGraph()
+    loaded.load_from_disk(fpath)
+
+    for g in [graph, loaded]:
+        v1, v2, v3, v4 = (g.to_internal(actor_id) for actor_id in [1, 2, 3, 4])
+        adj = g.graph._adj
+        assert adj[v1][v2] is adj[v2][v3] is adj[v3][v1]    # One dict for the cast of a movie.
+        assert adj[v3][v4] is not adj[v1][v2]
+        assert g.get_path_movies([1, 2, 3, 4]) == [7, 7, 8]
+
+
+@pytest.mark.asyncio
+async def test_get_path_max_dist():
+    graph = await build_graph()
+
+    assert len(graph.get_path(10, 40, max_dist=3)) == 4
+    assert graph.get_path(10, 10, max_dist=0) == [10]
+    assert graph.get_path(10, 70, max_dist=5) == []     # Not connected at all.
+    for max_dist in range(3):
+        with pytest.raises(DistanceLimitError) as e:
+            graph.get_path(10, 40, max_dist=max_dist)
+        assert e.value.farther_than == max_dist
+
+
+@pytest.mark.asyncio
+async def test_get_path_budget():
+    pairs = [(i, i + 1, i, 0, 0, 0, 0) for i in range(100)]     # A chain 0 - 1 - ... - 100.
+    graph = ActorsGraph(search_budget=10)
+    await graph.build_from_pairs(iterate_pairs(pairs))
+
+    assert len(graph.get_path(0, 9)) == 10
+    with pytest.raises(BudgetExceededError) as e:
+        graph.get_path(0, 100)
+    assert e.value.farther_than == 10   # Both searches went 5 steps.
+    with pytest.raises(DistanceLimitError):
+        graph.get_path(0, 100, max_dist=5)
+
+
+@pytest.mark.asyncio
+async def test_build_off_event_loop():
+    graph = ActorsGraph(reorder='bfs', storage='compressed')
+    released = threading.Event()
+    finish_graph = graph.finish_graph
+
+    def blocking_finish_graph(*args):
+        assert released.wait(5)     # Set from the event loop, which would be blocked otherwise.
+        return finish_graph(*args)
+
+    async def release():
+        await asyncio.sleep(0.05)
+        released.set()
+
+    graph.finish_graph = blocking_finish_graph
+    await asyncio.gather(graph.build_from_pairs(iterate_pairs(PAIRS)), release())
+
+    assert graph.ready
+    assert graph.get_path(10, 70) == []
+
+
+@pytest.mark.asyncio
+async def test_build_progress():
+    graph = ActorsGraph()
+    await graph.build_from_pairs(iterate_pairs(PAIRS), total=len(PAIRS))
+
+    assert graph.progress.stage == 'building'
+    assert graph.progress.done == graph.progress.total == len(PAIRS)
+    assert graph.progress.estimate_remaining() == 0
+
+
+@pytest.mark.asyncio
+async def test_get_path_stats():
+    graph = await build_graph()
+    stats = SearchStats()
+
+    graph.get_path(10, 40, stats=stats)
+    assert 0 < stats.expanded <= 5
+
+    graph.search_budget = 1
+    with pytest.raises(BudgetExceededError):
+        graph.get_path(10, 40, stats=stats)
+    assert stats.expanded == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_get_shortest_paths(reorder, storage):
+    graph = await build_graph(reorder, root=10, storage=storage)
+
+    result = graph.get_shortest_paths(10, 40)
+    assert (result.length, result.count) == (3, 2)
+    assert sorted(result.paths) == [[10, 20, 30, 40], [10, 20, 50, 40]]
+
+    result = graph.get_shortest_paths(10, 40, EdgeFilter(year_to=1995))
+    assert (result.length, result.count) == (3, 1)
+    assert list(result.paths) == [[10, 20, 30, 40]]
+
+    result = graph.get_shortest_paths(10, 70)
+    assert (result.length, result.count) == (-1, 0)
+    assert list(result.paths) == []
+
+    with pytest.raises(DistanceLimitError):
+        graph.get_shortest_paths(10, 40, max_dist=2)
+
+
+def test_shortest_paths_count_is_exact():
+    # A chain of 100 diamonds: 2^100 shortest paths, counted without enumerating them.
+    graph = nx.Graph()
+    for i in range(100):
+        graph.add_edges_from([(3 * i, 3 * i + 1), (3 * i, 3 * i + 2), (3 * i + 1, 3 * i + 3), (3 * i + 2, 3 * i + 3)])
+
+    result = shortest_paths(graph._adj.__getitem__, 0, 300)
+
+    assert (result.length, result.count) == (200, 2**100)
+    assert len(list(islice(result.paths, 10))) == 10
+
+
+def test_shortest_paths_scan_vertices_once():
+    # 0 - (1..10) - 11 - (12..21) - 22: 100 shortest paths, all through vertex 11.
+    graph = nx.Graph()
+    graph.add_edges_from((0, i) for i in range(1, 11))
+    graph.add_edges_from((i, 11) for i in range(1, 11))
+    graph.add_edges_from((11, i) for i in range(12, 22))
+    graph.add_edges_from((i, 22) for i in range(12, 22))
+    scans = Counter()
+
+    def neighbors(v):
+        scans[v] += 1
+        return graph._adj[v]
+
+    stats = SearchStats()
+    result = shortest_paths(neighbors, 0, 22, stats=stats)
+    searched = stats.expanded
+    scans.clear()
+
+    assert len(set(map(tuple, result.paths))) == result.count == 100
+    assert max(scans.values()) <= 2     # Once from each side at most, not once per path.
+    assert stats.expanded - searched == sum(scans.values())
+
+
+@pytest.mark.asyncio
+async def test_bfs_ordering_starts_from_root():
+    graph = await build_graph('bfs', root=40)
+
+    assert graph.external_ids[0] == 40
+    assert sorted(graph.external_ids) == [10, 20, 30, 40, 50, 60, 70]
+    assert sorted(graph.graph.nodes) == list(range(7))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_save_and_load(reorder, storage, tmp_path):
+    fpath = str(tmp_path / 'graph.pkl')
+    graph = await build_graph(reorder, root=10, storage=storage)
+    graph.save_to_disk(fpath)
+
+    loaded = ActorsGraph()  # Format and permutation come from the file regardless of the settings.
+    loaded.load_from_disk(fpath)
+
+    assert loaded.ready
+    assert type(loaded.graph) is type(graph.graph)
+    assert loaded.actor_ids() == graph.actor_ids()
+    assert loaded.get_path(30, 50) == graph.get_path(30, 50)
+    assert len(loaded.get_path(10, 40)) == 4
+    assert loaded.get_path_movies([10, 20, 50, 40]) == [1, 4, 5]
+    assert loaded.get_path(10, 40, EdgeFilter(year_to=1995)) == [10, 20, 30, 40]
+    assert loaded.generation == graph.generation is not None
+    assert loaded.progress.stage == 'loading'
+    assert loaded.progress.done == loaded.progress.total > 0
+
+
+def test_load_old_plain_dump(tmp_path):
+    fpath = str(tmp_path / 'graph.pkl')
+    graph = nx.Graph()
+    graph.add_edge(10, 20)  # Dumps of the first version had neither labels nor format.
+    nx.write_gpickle(graph, fpath)
+
+    with pytest.raises(ValueError, match='remove it to rebuild the graph'):
+        ActorsGraph().load_from_disk(fpath)
+
+
+def test_unknown_ordering():
+    with pytest.raises(ValueError):
+        ActorsGraph(reorder='random')
+    with pytest.raises(ValueError):
+        ActorsGraph(storage='zip')
+
+
+def test_compressed_neighbors():
+    graph = nx.Graph()
+    peers = [2, 3, 130, 200, 20000, 3000000]
+    graph.add_edges_from((1, peer, {'movie': peer * 10, 'min_year': peer % 2000}) for peer in peers)
+
+    compressed = CompressedAdjacency.from_graph(graph)
+
+    assert list(compressed.external_ids) == [1, *peers]
+    assert compressed.neighbors(0) == list(range(1, len(peers) + 1))
+    assert all(compressed.neighbors(i) == [0] for i in range(1, len(peers) + 1))
+    assert compressed.number_of_edges() == len(peers)
+    assert compressed.edge_movie(0, 3) == compressed.edge_movie(3, 0) == 1300
+    assert compressed.edge_movie(1, 2) is None
+    assert compressed.filtered_neighbors(0, EdgeFilter(year_to=500)) == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('reorder', [None, 'bfs'])
+async def test_compressed_vertex_lookup(reorder, tmp_path):
+    graph = await build_graph(reorder, root=40, storage='compressed')
+    fpath = str(tmp_path / 'graph.dump')
+    graph.save_to_disk(fpath)
+    loaded = ActorsGraph()
+    loaded.load_from_disk(fpath)
+
+    for g in [graph, loaded]:
+        assert g.internal_ids is None   # Looked up in the arrays, without a map of all actors.
+        assert [g.external_ids[g.to_internal(actor_id)] for actor_id in g.actor_ids()] == g.actor_ids()
+        assert g.to_internal(40) == (0 if reorder else 3)
+        assert g.to_internal(5) is g.to_internal(45) is g.to_internal(100) is None
+        assert len(g.graph.actor_order) == (7 if reorder else 0)
+
+
+@pytest.mark.asyncio
+async def test_compressed_labels_shared(tmp_path):
+    pairs = [(1, 2, 7, 2000, 2000, 1, 1), (1, 3, 7, 2000, 2000, 1, 1), (2, 3, 7, 2000, 2000, 1, 1),
+             (3, 4, 8, 2000, 2000, 1, 1)]
+    graph = ActorsGraph(storage='compressed')
+    await graph.build_from_pairs(iterate_pairs(pairs))
+    fpath = str(tmp_path / 'graph.dump')
+    graph.save_to_disk(fpath)
+    loaded = ActorsGraph()
+    loaded.load_from_disk(fpath)
+
+    for g in [graph, loaded]:
+        assert g.graph.num_labels() == 2    # One label for the cast of a movie.
+        assert list(g.graph.label_data['movies']) == [7, 8]
+        assert g.get_path_movies([1, 2, 3, 4]) == [7, 7, 8]
+        assert g.get_path(1, 4, EdgeFilter(year_from=2000)) == [1, 3, 4]
+
+
+def test_encode_gaps():
+    values = [0, 1, 127, 128, 300, 20000, 3000000]  # Gaps of 1 to 4 bytes.
+    data = bytearray()
+    encode_gaps(values, data)
+    encode_gaps([5], data)
+    boundary = len(data) - 1
+    adjacency = CompressedAdjacency(array('Q', [0, boundary, len(data)]), array('Q', [0, len(values), len(values) + 1]),
+                                    array('I', [7, 8]), array('I'), {}, array('I'),
+                                    bytes(data), 0)
+
+    assert adjacency.neighbors(0) == values
+    assert adjacency.neighbors(1) == [5]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('storage', ActorsGraph.storages)
+async def test_distance_matrix(storage):
+    graph = await build_graph('bfs', root=10, storage=storage)
+    actors = [10, 20, 30, 40, 50, 60, 70, 999]
+
+    matrix = graph.get_distance_matrix(actors, actors)
+
+    for i, id1 in enumerate(actors):
+        for j, id2 in enumerate(actors):
+            assert matrix[i][j] == len(graph.get_path(id1, id2)) - 1
+
+
+@pytest.mark.asyncio
+async def test_distance_matrix_batches():
+    pairs = [(i, i + 1, i, 0, 0, 0, 0) for i in range(100)]    # A chain 0 - 1 - ... - 100.
+    graph = ActorsGraph()
+    await graph.build_from_pairs(iterate_pairs(pairs))
+    sources = list(range(0, 101, 1)) + [5, 5]   # More than one batch, with duplicates.
+
+    matrix = graph.get_distance_matrix(sources, [0, 100])
+
+    assert matrix == [[s, 100 - s] for s in sources]
+
+
+@pytest.mark.asyncio
+async def test_distance_histograms():
+    graph = await build_graph()
+
+    histograms = graph.get_distance_histograms([10, 40, 60, 999])
+
+    assert histograms == [[1, 1, 2, 1], [1, 2, 1, 1], [1, 1], []]
@@ -0,0 +1,85 @@
+import sqlite3
+import pytest
+from service.backend import SqliteDatabase
+from service.backend.filters import EdgeFilter
+
+
+# Same schema as init/db_to_snapshot.py makes: 1 - 2 - 3 through movies 10 and 20 (or 30, a comedy of 2005).
+SCHEMA = '''
+    CREATE TABLE actors (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+    CREATE TABLE movies (id INTEGER NOT NULL, name TEXT NOT NULL, release_year INTEGER,
+                         genre_mask INTEGER NOT NULL, language_mask INTEGER NOT NULL);
+    CREATE TABLE genres (bit INTEGER NOT NULL, name TEXT PRIMARY KEY);
+    CREATE TABLE languages (bit INTEGER NOT NULL, code TEXT PRIMARY KEY);
+    CREATE TABLE cast_data (movie_id INTEGER NOT NULL, actor_id INTEGER NOT NULL);
+    CREATE TABLE peers (id1 INTEGER NOT NULL, id2 INTEGER NOT NULL, movie_id INTEGER NOT NULL,
+                        min_year INTEGER NOT NULL, max_year INTEGER NOT NULL,
+                        genre_mask INTEGER NOT NULL, language_mask INTEGER NOT NULL);
+    CREATE TABLE bacon_numbers (actor_id INTEGER PRIMARY KEY, bn INTEGER NOT NULL);
+    INSERT INTO actors VALUES (1, 'Kevin Bacon'), (2, 'Tom Hanks'), (3, 'Meg Ryan');
+    INSERT INTO movies VALUES (10, 'Apollo 13', 1995, 1, 1), (20, 'Sleepless in Seattle', 1993, 1, 1),
+                              (30, 'Some Comedy', 2005, 2, 2);
+    INSERT INTO genres VALUES (0, 'Drama'), (1, 'Comedy');
+    INSERT INTO languages VALUES (0, 'en'), (1, 'fr');
+    INSERT INTO cast_data VALUES (10, 1), (10, 2), (20, 2), (20, 3), (30, 2), (30, 3);
+    INSERT INTO peers VALUES (1, 2, 10, 1995, 1995, 1, 1), (2, 3, 20, 1993, 2005, 3, 3);
+    INSERT INTO bacon_numbers VALUES (1, 0), (2, 1), (3, 2);
+'''
+
+
+@pytest.fixture
+def snapshot_path(tmp_path) -> str:
+    fpath = str(tmp_path / 'snapshot.sqlite')
+    conn = sqlite3.connect(fpath)
+    conn.executescript(SCHEMA)
+    conn.close()
+    return fpath
+
+
+async def open_snapshot(fpath: str) -> SqliteDatabase:
+    db = SqliteDatabase(fpath)
+    await db.init()
+    return db
+
+
+@pytest.mark.asyncio
+async def test_actor_lookups(snapshot_path: str):
+    db = await open_snapshot(snapshot_path)
+    assert await db.get_actor_id('Tom Hanks') == 2
+    assert await db.get_actor_id('XXX') is None
+    assert await db.get_actor_ids(['Kevin Bacon', 'Meg Ryan', 'XXX']) == {'Kevin Bacon': 1, 'Meg Ryan': 3}
+    assert await db.get_actor_names([3, 1]) == {1: 'Kevin Bacon', 3: 'Meg Ryan'}
+
+
+@pytest.mark.asyncio
+async def test_dictionaries(snapshot_path: str):
+    db = await open_snapshot(snapshot_path)
+    assert (await db.get_movie_titles())[20] == 'Sleepless in Seattle'
+    assert await db.get_genres() == {'Drama': 0, 'Comedy': 1}
+    assert await db.get_languages() == {'en': 0, 'fr': 1}
+
+
+@pytest.mark.asyncio
+async def test_get_linking_movies(snapshot_path: str):
+    db = await open_snapshot(snapshot_path)
+    assert await db.get_linking_movies([1, 2, 3], EdgeFilter()) == [10, 20]
+    assert await db.get_linking_movies([1, 2, 3], EdgeFilter(year_from=2000)) == [None, 30]
+    assert await db.get_linking_movies([3, 2], EdgeFilter(genres=0b10, languages=0b10)) == [30]
+
+
+@pytest.mark.asyncio
+async def test_get_actor_pairs(snapshot_path: str):
+    db = await open_snapshot(snapshot_path)
+    pairs = [pair async for pair in db.get_actor_pairs()]
+
+    assert pairs == [(1, 2, 10, 1995, 1995, 1, 1), (2, 3, 20, 1993, 2005, 3, 3)]
+    assert await db.count_actor_pairs() == 2
+
+
+@pytest.mark.asyncio
+async def test_precomputed_tables(snapshot_path: str):
+    db = await open_snapshot(snapshot_path)
+    assert await db.get_bacon_number(3) == 2
+    assert await db.get_bacon_number(4) is None
+    assert await db.table_exists('peers')
+    assert not await db.table_exists('centrality')
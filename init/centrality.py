@@ -0,0 +1,173 @@
+"""
+Ranks actors by how good a center of the graph they are (Kevin Bacon is just a guess).
+
+Harmonic centrality of all actors is estimated by sampling: BFS from random pivots,
+averaging 1/distance (the graph is undirected, so distances from a pivot are distances to it).
+The best candidates by the estimate (plus Kevin Bacon) then get exact closeness, average
+distance, eccentricity and harmonic centrality with a full BFS each.
+
+Searches fan out across a process pool. The graph is loaded into flat arrays before the pool
+is forked, so workers share it read-only without copying or pickling.
+Results are written to `centrality` table, ranked by closeness.
+"""
+
+import os
+import time
+import random
+import asyncio
+import asyncpg
+import multiprocessing as mp
+from array import array
+from collections import deque
+from typing import List, Tuple
+
+
+DB_DSN = os.getenv('DB_DSN', 'postgres://postgres@localhost/postgres')
+WORKERS = int(os.getenv('WORKERS', str(os.cpu_count())))
+SAMPLES = int(os.getenv('SAMPLES', '500'))          # Pivots for harmonic centrality estimation.
+CANDIDATES = int(os.getenv('CANDIDATES', '1000'))   # Actors to evaluate exactly.
+SEED = int(os.getenv('SEED', '42'))
+CHUNK_SIZE = 16                                     # Sources per pool task.
+
+offsets = array('q')    # Graph in CSR format, actor IDs are vertex IDs: neighbors of v are
+targets = array('i')    # targets[offsets[v]:offsets[v + 1]]. Filled in before forking workers.
+
+
+async def load_graph(db: asyncpg.Connection):
+    global offsets, targets
+    print('Loading graph...')
+    num_nodes = await db.fetchval('select max(id) + 1 from actors')
+    degrees = array('q', [0]) * (num_nodes + 1)
+    async with db.transaction():
+        async for row in db.cursor('select id1, count(*) from peers group by id1'):
+            degrees[row[0] + 1] = row[1]
+
+    for v in range(num_nodes):
+        degrees[v + 1] += degrees[v]
+    offsets = degrees
+    targets = array('i', [0]) * offsets[-1]
+
+    counter = 0
+    fill = array('q', offsets)
+    async with db.transaction():
+        async for id1, id2 in db.cursor('select id1, id2 from peers'):
+            targets[fill[id1]] = id2
+            fill[id1] += 1
+            counter += 1
+            if counter % 1000000 == 0:
+                print(counter, 'edges loaded')
+    print(counter, 'edges loaded')
+
+
+def bfs(source: int) -> array:
+    distances = array('i', [-1]) * (len(offsets) - 1)
+    distances[source] = 0
+    queue = deque([source])
+    while queue:
+        v = queue.popleft()
+        next_distance = distances[v] + 1
+        for i in range(offsets[v], offsets[v + 1]):
+            u = targets[i]
+            if distances[u] < 0:
+                distances[u] = next_distance
+                queue.append(u)
+    return distances
+
+
+def harmonic_sums(sources: List[int]) -> array:
+    """Sums of 1/distance from the sources, for every vertex."""
+    sums = array('d', [0.0]) * (len(offsets) - 1)
+    for source in sources:
+        distances = bfs(source)
+        for v, d in enumerate(distances):
+            if d > 0:
+                sums[v] += 1.0 / d
+    return sums
+
+
+def exact_stats(source: int) -> Tuple[int, int, int, int, float]:
+    """Returns (source, reached actors, sum of distances, eccentricity, harmonic centrality)."""
+    reached = 0
+    total = 0
+    eccentricity = 0
+    harmonic = 0.0
+    for d in bfs(source):
+        if d > 0:
+            reached += 1
+            total += d
+            harmonic += 1.0 / d
+            if d > eccentricity:
+                eccentricity = d
+    return source, reached, total, eccentricity, harmonic
+
+
+def estimate_harmonic(pool: mp.Pool, actors: List[int]) -> array:
+    print(f'Estimating harmonic centrality from {SAMPLES} pivots...')
+    pivots = random.Random(SEED).sample(actors, min(SAMPLES, len(actors)))
+    chunks = [pivots[i:i + CHUNK_SIZE] for i in range(0, len(pivots), CHUNK_SIZE)]
+    estimate = array('d', [0.0]) * (len(offsets) - 1)
+    for counter, sums in enumerate(pool.imap_unordered(harmonic_sums, chunks), 1):
+        for v, value in enumerate(sums):
+            estimate[v] += value
+        print(f'{min(counter * CHUNK_SIZE, len(pivots))} pivots processed')
+
+    scale = len(actors) / len(pivots)
+    for v in range(len(estimate)):
+        estimate[v] *= scale
+    return estimate
+
+
+def evaluate_candidates(pool: mp.Pool, candidates: List[int], num_actors: int) -> List[tuple]:
+    print(f'Evaluating {len(candidates)} candidates...')
+    results = []
+    for counter, (actor_id, reached, total, eccentricity, harmonic) in enumerate(
+            pool.imap_unordered(exact_stats, candidates, chunksize=CHUNK_SIZE), 1):
+        if reached > 0:
+            # Wasserman-Faust closeness, comparable across components of different size.
+            closeness = reached / total * reached / (num_actors - 1)
+            avg_distance = total / reached
+        else:
+            closeness = avg_distance = 0.0
+        results.append((actor_id, closeness, avg_distance, eccentricity, harmonic / (num_actors - 1), reached))
+        if counter % 100 == 0:
+            print(counter, 'candidates evaluated')
+
+    results.sort(key=lambda r: r[1], reverse=True)
+    return [(rank, *r) for rank, r in enumerate(results, 1)]
+
+
+async def save_results(db: asyncpg.Connection, results: List[tuple]):
+    print('Saving results...')
+    async with db.transaction():
+        await db.execute('DROP TABLE IF EXISTS centrality')
+        await db.execute('CREATE TABLE centrality (rank INTEGER NOT NULL, actor_id INTEGER NOT NULL, '
+                         'closeness REAL NOT NULL, avg_distance REAL NOT NULL, eccentricity SMALLINT NOT NULL, '
+                         'harmonic REAL NOT NULL, reached INTEGER NOT NULL, PRIMARY KEY (rank))')
+        await db.copy_records_to_table('centrality', records=results)
+
+
+async def main():
+    db = await asyncpg.connect(DB_DSN, user=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    await load_graph(db)
+    bacon_id = await db.fetchval("select id from actors where name = 'Kevin Bacon'")
+    actors = [v for v in range(len(offsets) - 1) if offsets[v + 1] > offsets[v]]
+    start = time.monotonic()
+
+    with mp.get_context('fork').Pool(WORKERS) as pool:
+        estimate = estimate_harmonic(pool, actors)
+        candidates = sorted(actors, key=estimate.__getitem__, reverse=True)[:CANDIDATES]
+        if bacon_id is not None and bacon_id not in candidates:
+            candidates.append(bacon_id)
+        results = evaluate_candidates(pool, candidates, len(actors))
+
+    print(f'Computed in {round(time.monotonic() - start, 1)}s on {WORKERS} workers')
+    await save_results(db, results)
+    names = dict(await db.fetch('select id, name from actors where id = any($1)', [r[1] for r in results[:10]]))
+    await db.close()
+    for rank, actor_id, closeness, avg_distance, eccentricity, _, _ in results[:10]:
+        print(f'{rank}. {names[actor_id]}: average distance {round(avg_distance, 3)}, eccentricity {eccentricity}')
+    print('Done')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -7,12 +7,16 @@ import os
 import csv
 import asyncio
 import asyncpg
-from typing import List, Dict, Any
+from ast import literal_eval
+from collections import Counter
+from typing import List, Dict, Any, Optional
 
 
 DB_DSN = os.getenv('DB_DSN', 'postgres://postgres@localhost/postgres')
 MOVIES_CSV_PATH = 'dataset/movies_metadata.csv'
 ACTORS_CSV_PATH = 'dataset/credits.csv'
+GENRE_BITS = 31     # Genre masks are stored in signed INTEGER.
+LANGUAGE_BITS = 63  # Language masks are stored in signed BIGINT.
 actors_lookup = {}  # type: Dict[str, int]
 
 
@@ -21,11 +25,19 @@ async def init_db(db: asyncpg.Connection):
     await db.execute('DROP TABLE IF EXISTS peers')
     await db.execute('DROP TABLE IF EXISTS bacon_numbers')
     await db.execute('DROP TABLE IF EXISTS movies')
+    await db.execute('DROP TABLE IF EXISTS genres')
+    await db.execute('DROP TABLE IF EXISTS languages')
     await db.execute('DROP TABLE IF EXISTS actors')
-    await db.execute('CREATE TABLE movies (id INTEGER NOT NULL, name TEXT NOT NULL)')
+    await db.execute('CREATE TABLE movies (id INTEGER NOT NULL, name TEXT NOT NULL, release_year SMALLINT, '
+                     'language TEXT NOT NULL, popularity REAL, genres TEXT NOT NULL, '
+                     'genre_mask INTEGER NOT NULL, language_mask BIGINT NOT NULL)')
+    await db.execute('CREATE TABLE genres (bit SMALLINT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (name))')
+    await db.execute('CREATE TABLE languages (bit SMALLINT NOT NULL, code TEXT NOT NULL, PRIMARY KEY (code))')
     await db.execute('CREATE TABLE actors (id INTEGER NOT NULL GENERATED ALWAYS AS IDENTITY, name TEXT NOT NULL)')
     await db.execute('CREATE TABLE cast_data (movie_id INTEGER NOT NULL, actor_id INTEGER NOT NULL)')
-    await db.execute('CREATE TABLE peers (id1 INTEGER NOT NULL, id2 INTEGER NOT NULL)')
+    await db.execute('CREATE TABLE peers (id1 INTEGER NOT NULL, id2 INTEGER NOT NULL, movie_id INTEGER NOT NULL, '
+                     'min_year SMALLINT NOT NULL, max_year SMALLINT NOT NULL, '
+                     'genre_mask INTEGER NOT NULL, language_mask BIGINT NOT NULL)')
     await db.execute('CREATE TABLE bacon_numbers (actor_id INTEGER NOT NULL, bn SMALLINT NOT NULL, '
                      'PRIMARY KEY (actor_id))')
 
@@ -34,10 +46,12 @@ async def import_movies(fpath: str, db: asyncpg.Connection):
     print('Importing movies from the dataset...')
     counter = 0
     met = set()
-    with open(fpath, 'rt', newline='') as input_csv, open('movies.csv', 'wt', newline='') as out_csv:
+    movies = []
+    genres = Counter()
+    languages = Counter()
+    with open(fpath, 'rt', newline='') as input_csv:
         input_csv.readline()
         csv_reader = csv.reader(input_csv)
-        csv_writer = csv.writer(out_csv, delimiter=',')
         for row in csv_reader:
             id_ = row[5]
             name = row[8]
@@ -46,16 +60,46 @@ async def import_movies(fpath: str, db: asyncpg.Connection):
                 if iid in met:
                     print(f'Duplicate movie ID: {id_} ({name}), skipping...')
                 else:
-                    csv_writer.writerow((iid, name))
+                    movie_genres = [genre['name'] for genre in literal_eval(row[3])]
+                    genres.update(movie_genres)
+                    languages[row[7]] += 1
+                    movies.append((iid, name, parse_year(row[14]), row[7], parse_float(row[10]), movie_genres))
                     met.add(iid)
                     counter += 1
             except ValueError:                  # Unquoted string
                 print(f'Unexpected value for ID: {id_}, skipping...')
 
+    # Most common genres and languages get a bit each in the masks, the rest share the last bit.
+    # The API tells them by the shared bit in genres and languages tables and refuses to filter by them.
+    genre_bits = {name: min(bit, GENRE_BITS - 1) for bit, (name, _) in enumerate(genres.most_common())}
+    language_bits = {code: min(bit, LANGUAGE_BITS - 1) for bit, (code, _) in enumerate(languages.most_common())}
+    with open('movies.csv', 'wt', newline='') as out_csv:
+        csv_writer = csv.writer(out_csv, delimiter=',')
+        for iid, name, year, language, popularity, movie_genres in movies:
+            genre_mask = sum(1 << bit for bit in {genre_bits[genre] for genre in movie_genres})
+            csv_writer.writerow((iid, name, year, language, popularity, '|'.join(movie_genres),
+                                 genre_mask, 1 << language_bits[language]))
+
     await db.copy_to_table('movies', source='movies.csv', format='csv', delimiter=',')
+    await db.copy_records_to_table('genres', records=[(bit, name) for name, bit in genre_bits.items()])
+    await db.copy_records_to_table('languages', records=[(bit, code) for code, bit in language_bits.items()])
     print(counter, 'movies imported')
 
 
+def parse_year(release_date: str) -> Optional[int]:
+    try:
+        return int(release_date[:4])
+    except ValueError:
+        return None
+
+
+def parse_float(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
 async def import_actors(fpath: str, db: asyncpg.Connection):
     print('Importing cast data from the dataset...')
     counter = 0
@@ -108,14 +152,21 @@ async def calculate_pairs(db: asyncpg.Connection):
     print('Generating pairs...')
     query = '''
         insert into peers
-        select distinct a1.id, a2.id
+        select a1.id, a2.id,
+            min(c1.movie_id),                       -- One representative movie linking the pair.
+            coalesce(min(m.release_year), 0),       -- Attributes of all movies linking the pair,
+            coalesce(max(m.release_year), 0),       -- to filter edges by, 0 if unknown.
+            coalesce(bit_or(m.genre_mask), 0),
+            coalesce(bit_or(m.language_mask), 0)
         from actors a1
         join cast_data c1 on a1.id = c1.actor_id
         --join movies m on c1.movie_id = m.id
         --join cast_data c2 on m.id = c2.movie_id
         join cast_data c2 on c1.movie_id = c2.movie_id
         join actors a2 on c2.actor_id = a2.id
+        left join movies m on c1.movie_id = m.id
         where a1.id != a2.id
+        group by a1.id, a2.id
     '''
     await db.execute(query)
     print('Indexing...')
@@ -123,7 +174,7 @@ async def calculate_pairs(db: asyncpg.Connection):
 
 
 async def calculate_bacon(db: asyncpg.Connection):
-    print('Calculating Bacon numbers (for test purposes, not used in API)...')
+    print('Calculating Bacon numbers (served by API while the graph is loading)...')
     bacon_id = await db.fetchval("select id from actors where name = 'Kevin Bacon'")
     await db.execute('insert into bacon_numbers values ($1, 0)', bacon_id)
 
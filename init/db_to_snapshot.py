@@ -0,0 +1,99 @@
+"""
+Exports the tables the API needs from Postgres into a single read-only SQLite file.
+API instances given the file (DB_SNAPSHOT_PATH) run without Postgres.
+
+Only one direction of every pair of peers is kept (id1 < id2), that is all the API reads.
+The snapshot is written next to the destination and renamed when complete, so instances
+never see a partial file.
+"""
+
+import os
+import sqlite3
+import asyncio
+import asyncpg
+
+
+DB_DSN = os.getenv('DB_DSN', 'postgres://postgres@localhost/postgres')
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'snapshot.sqlite')
+
+# Table, its schema in the snapshot, the query to fill it from Postgres.
+TABLES = [
+    ('actors', 'id INTEGER PRIMARY KEY, name TEXT NOT NULL',
+     'select id, name from actors'),
+    ('movies', 'id INTEGER NOT NULL, name TEXT NOT NULL, release_year INTEGER, '
+               'genre_mask INTEGER NOT NULL, language_mask INTEGER NOT NULL',
+     'select id, name, release_year, genre_mask, language_mask from movies'),
+    ('genres', 'bit INTEGER NOT NULL, name TEXT PRIMARY KEY',
+     'select bit, name from genres'),
+    ('languages', 'bit INTEGER NOT NULL, code TEXT PRIMARY KEY',
+     'select bit, code from languages'),
+    ('cast_data', 'movie_id INTEGER NOT NULL, actor_id INTEGER NOT NULL',
+     'select movie_id, actor_id from cast_data'),
+    ('peers', 'id1 INTEGER NOT NULL, id2 INTEGER NOT NULL, movie_id INTEGER NOT NULL, '
+              'min_year INTEGER NOT NULL, max_year INTEGER NOT NULL, '
+              'genre_mask INTEGER NOT NULL, language_mask INTEGER NOT NULL',
+     'select id1, id2, movie_id, min_year, max_year, genre_mask, language_mask from peers where id1 < id2'),
+    ('bacon_numbers', 'actor_id INTEGER PRIMARY KEY, bn INTEGER NOT NULL',
+     'select actor_id, bn from bacon_numbers'),
+    ('centrality', 'rank INTEGER PRIMARY KEY, actor_id INTEGER NOT NULL, closeness REAL NOT NULL, '
+                   'avg_distance REAL NOT NULL, eccentricity INTEGER NOT NULL, harmonic REAL NOT NULL, '
+                   'reached INTEGER NOT NULL',
+     'select rank, actor_id, closeness, avg_distance, eccentricity, harmonic, reached from centrality'),
+]
+INDICES = [
+    'CREATE INDEX actors_name ON actors (name)',
+    'CREATE INDEX movies_id ON movies (id)',
+    'CREATE INDEX cast_data_actor ON cast_data (actor_id, movie_id)',
+]
+BATCH_SIZE = 10000
+
+
+async def copy_table(db: asyncpg.Connection, snapshot: sqlite3.Connection, table: str, schema: str, query: str):
+    if not await db.fetchval('select 1 from information_schema.tables where table_name = $1', table):
+        print(f'Table {table} does not exist, skipping')
+        return
+
+    print(f'Copying {table}...')
+    snapshot.execute(f'CREATE TABLE {table} ({schema})')
+    insert = f'INSERT INTO {table} VALUES ({", ".join("?" * (schema.count(",") + 1))})'
+    counter = 0
+    batch = []
+    async with db.transaction():
+        async for row in db.cursor(query, prefetch=BATCH_SIZE):
+            batch.append(tuple(row))
+            if len(batch) == BATCH_SIZE:
+                snapshot.executemany(insert, batch)
+                counter += len(batch)
+                batch = []
+    snapshot.executemany(insert, batch)
+    counter += len(batch)
+    print(counter, 'rows copied')
+
+
+async def main():
+    tmp_path = SNAPSHOT_PATH + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = await asyncpg.connect(DB_DSN, user=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'))
+    snapshot = sqlite3.connect(tmp_path)
+    snapshot.execute('PRAGMA journal_mode = OFF')
+    snapshot.execute('PRAGMA synchronous = OFF')
+
+    for table, schema, query in TABLES:
+        await copy_table(db, snapshot, table, schema, query)
+
+    print('Indexing...')
+    for index in INDICES:
+        snapshot.execute(index)
+    snapshot.commit()
+    snapshot.execute('VACUUM')
+    snapshot.close()
+    await db.close()
+
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    print(f'Snapshot saved to {SNAPSHOT_PATH} ({round(os.path.getsize(SNAPSHOT_PATH) / 2**20)} MB)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())